@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# read-ahead / write-behind helpers overlapping file I/O latency (e.g. network file systems) with computation
+# in single process conversions (pano2sem.py, remap_coco.py without --workers):
+# - PrefetchSource wraps a mask source (see mask_source.py); read_ahead lets background threads read (and decode)
+#   the masks of upcoming items while the current item is processed
+# - AsyncWriter writes encoded outputs in a background thread (used by mask_source.DeferredOutputs)
+# both are bounded to a number of frames (backpressure: producers block once the limit is reached);
+# failed background reads are repeated when the mask is accessed (same errors as without read-ahead),
+# write errors are reported per frame (see AsyncWriter.take_errors), frames whose outputs are completely written
+# are confirmed by AsyncWriter.take_done (e.g. before recording them in an incremental manifest)
+#
+# example:
+# src = PrefetchSource(mask_source('masks/'))
+# for a in read_ahead(annotations, src, lambda a: (a['file_name'], True), depth=8):
+#     bgr = src.imread(a['file_name'])
+#
+# see https://github.com/ozendelait/wilddash_scripts
+#
+# Use this tool on your own risk!
+# Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
+# All rights reserved.
+#******************************************************************************
+
+import os
+import queue
+import threading
+import collections
+import concurrent.futures
+from stage_profile import prof_stage
+from mask_source import imdecode_data, is_deferred_write, defer_copy
+
+#mask source serving prefetched masks (file content and optionally the decoded image) of the underlying source src;
+#masks which are not prefetched are read from src directly; use from a single (main) thread only
+class PrefetchSource:
+    def __init__(self, src, threads=2):
+        self.src = src
+        self.pool = concurrent.futures.ThreadPoolExecutor(max(1, threads))
+        self.pending = {} #name -> [future of (data, decoded image or None), reference count]
+
+    def _load(self, name, decode):
+        data = self.src.read(name)
+        return data, imdecode_data(data) if decode else None
+
+    def prefetch(self, name, decode=True):
+        if name in self.pending:
+            self.pending[name][1] += 1
+        else:
+            self.pending[name] = [self.pool.submit(self._load, name, decode), 1]
+
+    def release(self, name):
+        entry = self.pending.get(name)
+        if not entry is None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.pending[name]
+
+    #(data, decoded image or None) of a prefetched mask; None if not prefetched or if the background read failed
+    #(the mask is then accessed directly which reports errors exactly as without prefetching)
+    def _result(self, name, prof=None):
+        entry = self.pending.get(name)
+        if entry is None:
+            return None
+        with prof_stage(prof, 'read_wait'):
+            try:
+                return entry[0].result()
+            except Exception:
+                return None
+
+    def is_valid(self):
+        return self.src.is_valid()
+
+    def path(self, name):
+        return self.src.path(name)
+
+    def read(self, name):
+        res = self._result(name)
+        return self.src.read(name) if res is None else res[0]
+
+    def imread(self, name, prof=None):
+        res = self._result(name, prof)
+        if res is None:
+            return self.src.imread(name, prof)
+        if res[1] is None:
+            with prof_stage(prof, 'png_decode'):
+                return imdecode_data(res[0])
+        return res[1]
+
+    def copy_to(self, name, trg_path, prof=None):
+        res = self._result(name, prof)
+        if res is None or not is_deferred_write(trg_path):
+            return self.src.copy_to(name, trg_path, prof)
+        with prof_stage(prof, 'fs_copy'):
+            defer_copy(trg_path, res[0])
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        self.pending = {}
+
+#yields all items while the masks of the next depth items are prefetched by src (PrefetchSource);
+#key(item) returns (mask name, True if the decoded image is needed) or None if item needs no mask;
+#prefetched data of an item is released when the next item is requested
+def read_ahead(items, src, key, depth=4):
+    pending = collections.deque()
+    def next_item():
+        item, k = pending.popleft()
+        yield item
+        if not k is None:
+            src.release(k[0])
+    for item in items:
+        k = key(item)
+        if not k is None:
+            src.prefetch(*k)
+        pending.append((item, k))
+        if len(pending) > depth:
+            yield from next_item()
+    while len(pending) > 0:
+        yield from next_item()
+
+#writes (path, file content) lists in a background thread; submit blocks if max_pending lists are waiting (backpressure)
+#each file is written to <path>.tmp and renamed (no partially written outputs after aborted runs)
+#errors are collected per tag (e.g. frame name) and returned by take_errors; tags of completely written lists by take_done
+class AsyncWriter:
+    def __init__(self, max_pending=4):
+        self.queue = queue.Queue(max(1, max_pending))
+        self.errors, self.done, self.lock = [], [], threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            writes, tag = job
+            for path, data in writes:
+                try:
+                    with open(path+'.tmp', 'wb') as ofile:
+                        ofile.write(data)
+                    os.replace(path+'.tmp', path)
+                except Exception as e:
+                    if os.path.exists(path+'.tmp'):
+                        os.remove(path+'.tmp')
+                    with self.lock:
+                        self.errors.append((tag, "failed writing %s: %s"%(path, str(e))))
+                    break
+            else:
+                with self.lock:
+                    self.done.append(tag)
+
+    def submit(self, writes, tag=None):
+        if len(writes) > 0:
+            self.queue.put((writes, tag))
+        else:
+            with self.lock:
+                self.done.append(tag)
+
+    #returns and clears list of (tag, error message) of all failed writes so far
+    def take_errors(self):
+        with self.lock:
+            ret, self.errors = self.errors, []
+        return ret
+
+    #returns and clears list of tags whose writes all finished successfully so far
+    def take_done(self):
+        with self.lock:
+            ret, self.done = self.done, []
+        return ret
+
+    #waits until all writes are finished
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# throughput benchmark for the conversion hot paths of pano2sem.py, remap_coco.py and remap_delta.py using synthetic data
+# reports frames/s, MB/s and peak python/numpy memory per stage and stores machine-readable results for comparisons
+#
+# example:
+# python benchmark.py --frames 20 --width 1920 --height 1080 --segments 200 --output bench_new.json --compare bench_old.json
+#
+# see https://github.com/ozendelait/wilddash_scripts
+#
+# Use this tool on your own risk!
+# Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
+# All rights reserved.
+#******************************************************************************
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import cv2
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'remap_delta'))
+from pano_codec import MaskCodec
+from pano2sem import bgrids_to_intids, intids_to_bgrids, panoptic2segm, tqdm_none
+from remap_coco import remap_annotation, remapings_from_json
+from remap_delta import remap_inplace_json, poly2bbox, canonize_name
+
+all_stages = ['bgrids_to_intids', 'intids_to_bgrids', 'codec_decode', 'codec_encode', 'panoptic2segm', 'remap_annotation', 'remap_inplace_json_pano', 'remap_inplace_json_polygons']
+
+#random blocky segment layout with num_segments labels (index image of shape (height, width))
+def synth_segment_layout(rng, width, height, num_segments):
+    bs = max(1, int((width*height/(num_segments*8))**0.5))
+    gh, gw = (height+bs-1)//bs, (width+bs-1)//bs
+    grid = rng.integers(0, num_segments, size=(gh, gw))
+    grid[np.unravel_index(rng.permutation(gh*gw)[:num_segments], grid.shape)] = np.arange(min(num_segments, gh*gw))
+    return grid.repeat(bs, 0).repeat(bs, 1)[:height, :width]
+
+# creates a panoptic COCO dataset with categories of src_dataset from the meta json (<root>/panoptic.json + <root>/panoptic/*.png)
+def synth_panoptic(root, num_frames=20, width=1920, height=1080, num_segments=200, meta_json='wd2_unified_label_policy.json', src_dataset='wd2', seed=0):
+    rng = np.random.default_rng(seed)
+    cats = json.load(open(meta_json))['per_ds'][src_dataset]
+    os.makedirs(root+'/panoptic', exist_ok=True)
+    images, annotations = [], []
+    for f in range(num_frames):
+        layout = synth_segment_layout(rng, width, height, num_segments)
+        seg_ids = rng.choice(np.arange(1, 2**24, dtype=np.uint32), size=num_segments, replace=False)
+        file_name = 'frame%06i.png'%f
+        cv2.imwrite(root+'/panoptic/'+file_name, intids_to_bgrids(seg_ids[layout]))
+        area = np.bincount(layout.ravel(), minlength=num_segments)
+        #per segment: which rows/cols contain at least one of its pixels
+        rows = np.bincount((layout*height+np.arange(height)[:, None]).ravel(), minlength=num_segments*height).reshape((num_segments, height)) > 0
+        cols = np.bincount((layout*width+np.arange(width)[None, :]).ravel(), minlength=num_segments*width).reshape((num_segments, width)) > 0
+        y0, y1 = rows.argmax(axis=1), height-1-rows[:, ::-1].argmax(axis=1)
+        x0, x1 = cols.argmax(axis=1), width-1-cols[:, ::-1].argmax(axis=1)
+        segments_info = []
+        for k in range(num_segments):
+            if area[k] == 0:
+                continue
+            segments_info.append({'id': int(seg_ids[k]), 'category_id': int(cats[rng.integers(0, len(cats))]['id']), 'iscrowd': 0,
+                                  'area': int(area[k]), 'bbox': [int(x0[k]), int(y0[k]), int(x1[k]-x0[k]+1), int(y1[k]-y0[k]+1)]})
+        images.append({'id': 'frame%06i'%f, 'file_name': 'frame%06i.jpg'%f, 'width': width, 'height': height})
+        annotations.append({'image_id': 'frame%06i'%f, 'file_name': file_name, 'segments_info': segments_info})
+    json.dump({'images': images, 'annotations': annotations, 'categories': cats}, open(root+'/panoptic.json', 'w'))
+    return root+'/panoptic.json'
+
+# creates a delta relabel file for panoptic json_path changing num_changes segments per frame to new_cat_name
+def synth_panoptic_delta(json_path, delta_path, num_changes=10, new_cat_name='synthetic-van', seed=0):
+    rng = np.random.default_rng(seed)
+    pano0 = json.load(open(json_path))
+    id2name = {c['id']: c['name'] for c in pano0['categories']}
+    annotations = []
+    for a in pano0['annotations']:
+        segms = [a['segments_info'][i] for i in rng.permutation(len(a['segments_info']))[:num_changes]]
+        annotations.append({'image_id': a['image_id'], 'segments_info': [{'id': s['id'], 'old': canonize_name(id2name[s['category_id']]), 'new': canonize_name(new_cat_name),
+                            'bbox': s['bbox'], 'area': s['area']} for s in segms]})
+    json.dump({'categories': [{'name': new_cat_name, 'isthing': 1, 'supercategory': 'vehicle', 'color': [0, 0, 90]}],
+               'annotations': annotations}, open(delta_path, 'w'))
+
+# creates a Cityscapes-style folder of polygon jsons (<root>/polygons/<city>/*_gtFine_polygons.json) and a matching delta file
+def synth_polygons(root, delta_path, num_frames=20, width=2048, height=1024, num_polygons=100, num_vertices=50, num_changes=10, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = ['road', 'sidewalk', 'building', 'car', 'truck', 'person', 'vegetation', 'sky']
+    os.makedirs(root+'/polygons/synth', exist_ok=True)
+    annotations = []
+    for f in range(num_frames):
+        objects = []
+        for _ in range(num_polygons):
+            cx, cy, r = rng.uniform(0, width), rng.uniform(0, height), rng.uniform(5, 200)
+            ang = np.sort(rng.uniform(0, 2*np.pi, size=num_vertices))
+            poly = np.stack([np.clip(cx+r*np.cos(ang), 0, width-1), np.clip(cy+r*np.sin(ang), 0, height-1)], axis=1)
+            objects.append({'label': labels[rng.integers(0, len(labels))], 'polygon': np.round(poly).astype(int).tolist()})
+        fn = 'synth_%06i_000019'%f
+        json.dump({'imgHeight': height, 'imgWidth': width, 'objects': objects}, open(root+'/polygons/synth/'+fn+'_gtFine_polygons.json', 'w'))
+        annotations.append({'image_id': fn, 'segments_info': [{'id': int(i), 'old': objects[i]['label'], 'new': 'synthetic-van',
+                            'bbox': poly2bbox(objects[i]['polygon'])} for i in rng.permutation(num_polygons)[:num_changes]]})
+    json.dump({'categories': [], 'annotations': annotations}, open(delta_path, 'w'))
+    return root+'/polygons'
+
+def dir_size(p):
+    if os.path.isfile(p):
+        return os.path.getsize(p)
+    return sum(os.path.getsize(os.path.join(r, f)) for r, _, fs in os.walk(p) for f in fs)
+
+#best time of repeat runs (setup is called before each run and not timed) and peak of traced python/numpy memory
+def time_stage(func, setup=None, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        if setup: setup()
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter()-t0)
+    if setup: setup()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def run_benchmark(tmp_dir, stages=all_stages, num_frames=20, width=1920, height=1080, num_segments=200, num_polygons=100, num_vertices=50,
+                  workers=1, repeat=3, meta_json='wd2_unified_label_policy.json', seed=0):
+    json_path = synth_panoptic(tmp_dir+'/pano', num_frames, width, height, num_segments, meta_json=meta_json, seed=seed)
+    mask_dir = tmp_dir+'/pano/panoptic/'
+    mask_bytes = dir_size(mask_dir)
+    annotations = json.load(open(json_path))['annotations']
+    results = {}
+    def add_result(stage, n_frames, n_bytes, seconds, peak):
+        results[stage] = {'frames': n_frames, 'megabytes': n_bytes/2**20, 'seconds': seconds, 'frames_per_s': n_frames/max(seconds, 1e-9),
+                          'mb_per_s': n_bytes/2**20/max(seconds, 1e-9), 'peak_mem_mb': peak/2**20}
+    if 'bgrids_to_intids' in stages or 'intids_to_bgrids' in stages:
+        bgrs = [cv2.imread(mask_dir+a['file_name']) for a in annotations]
+        ids = [bgrids_to_intids(b) for b in bgrs]
+        if 'bgrids_to_intids' in stages:
+            add_result('bgrids_to_intids', len(bgrs), sum(b.nbytes for b in bgrs), *time_stage(lambda: [bgrids_to_intids(b) for b in bgrs], repeat=repeat))
+        if 'intids_to_bgrids' in stages:
+            #intids_to_bgrids returns a view; include materializing it (as done by cv2.imwrite)
+            add_result('intids_to_bgrids', len(ids), sum(i.nbytes for i in ids), *time_stage(lambda: [np.ascontiguousarray(intids_to_bgrids(i)) for i in ids], repeat=repeat))
+        del bgrs, ids
+    if 'codec_decode' in stages or 'codec_encode' in stages:
+        #same conversions using the reused buffers of pano_codec (results are consumed frame by frame)
+        codec = MaskCodec()
+        bgrs = [cv2.imread(mask_dir+a['file_name']) for a in annotations]
+        ids = [bgrids_to_intids(b) for b in bgrs]
+        if 'codec_decode' in stages:
+            add_result('codec_decode', len(bgrs), sum(b.nbytes for b in bgrs), *time_stage(lambda: [codec.decode(b) for b in bgrs], repeat=repeat))
+        if 'codec_encode' in stages:
+            add_result('codec_encode', len(ids), sum(i.nbytes for i in ids), *time_stage(lambda: [codec.encode(i) for i in ids], repeat=repeat))
+        del bgrs, ids
+    if 'panoptic2segm' in stages:
+        outp = tmp_dir+'/segm'
+        add_result('panoptic2segm', num_frames, mask_bytes, *time_stage(lambda: panoptic2segm(json_path, outp+'/sem', outp+'/inst', tqdm_vers=tqdm_none, workers=workers), repeat=repeat))
+    if 'remap_annotation' in stages:
+        src_to_trg, src_is_thing, trg_is_thing, _ = remapings_from_json(json.load(open(meta_json)), 'wd2eval')
+        trg_dir = tmp_dir+'/remapped/'
+        def remap_all():
+            for a in json.load(open(json_path))['annotations']:
+                remap_annotation(a, src_to_trg, src_is_thing=src_is_thing, trg_is_thing=trg_is_thing, src_dir=mask_dir, trg_dir=trg_dir)
+        os.makedirs(trg_dir, exist_ok=True)
+        add_result('remap_annotation', num_frames, mask_bytes, *time_stage(remap_all, repeat=repeat))
+    if 'remap_inplace_json_pano' in stages:
+        delta_path, change_path = tmp_dir+'/delta_pano.json', tmp_dir+'/change_pano.json'
+        synth_panoptic_delta(json_path, delta_path, seed=seed)
+        add_result('remap_inplace_json_pano', num_frames, dir_size(json_path),
+                   *time_stage(lambda: remap_inplace_json(change_path, delta_path, tqdm_vers=tqdm_none), setup=lambda: shutil.copy(json_path, change_path), repeat=repeat))
+    if 'remap_inplace_json_polygons' in stages:
+        delta_path = tmp_dir+'/delta_polygons.json'
+        poly_dir = synth_polygons(tmp_dir+'/cs', delta_path, num_frames, num_polygons=num_polygons, num_vertices=num_vertices, seed=seed)
+        change_dir = tmp_dir+'/cs/change'
+        def setup_polygons():
+            if os.path.exists(change_dir):
+                shutil.rmtree(change_dir)
+            shutil.copytree(poly_dir, change_dir)
+        add_result('remap_inplace_json_polygons', num_frames, dir_size(poly_dir),
+                   *time_stage(lambda: remap_inplace_json(change_dir, delta_path, tqdm_vers=tqdm_none), setup=setup_polygons, repeat=repeat))
+    return results
+
+def bench_main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stages', type=str, default=','.join(all_stages),
+                        help="Comma-separated list of stages to run (default: all)")
+    parser.add_argument('--frames', type=int, default=20, help="Number of synthetic frames")
+    parser.add_argument('--width', type=int, default=1920, help="Width of synthetic masks")
+    parser.add_argument('--height', type=int, default=1080, help="Height of synthetic masks")
+    parser.add_argument('--segments', type=int, default=200, help="Number of segments per panoptic frame")
+    parser.add_argument('--polygons', type=int, default=100, help="Number of polygons per Cityscapes-style frame")
+    parser.add_argument('--vertices', type=int, default=50, help="Number of vertices per polygon")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes for panoptic2segm")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of timed runs per stage (best run is reported)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed of synthetic data")
+    parser.add_argument('--meta_json', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wd2_unified_label_policy.json'),
+                        help="category meta json file")
+    parser.add_argument('--tmp_dir', type=str, default=None, help="Directory for synthetic data (default: new temporary directory, removed afterwards)")
+    parser.add_argument('--output', type=str, default=None, help="Write results to this json file")
+    parser.add_argument('--compare', type=str, default=None, help="Results json of a previous run to compare against")
+    args = parser.parse_args(argv)
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    if any(not s in all_stages for s in stages):
+        print("Error: unknown stage; valid stages are: ", all_stages)
+        return -1
+    tmp_dir = args.tmp_dir or tempfile.mkdtemp(prefix='wd_bench_')
+    try:
+        results = run_benchmark(tmp_dir, stages, args.frames, args.width, args.height, args.segments, args.polygons, args.vertices,
+                                workers=args.workers, repeat=args.repeat, meta_json=args.meta_json, seed=args.seed)
+    finally:
+        if args.tmp_dir is None:
+            shutil.rmtree(tmp_dir)
+    report = {'config': {k: v for k, v in vars(args).items() if not k in ['output', 'compare', 'tmp_dir']},
+              'system': {'python': platform.python_version(), 'numpy': np.__version__, 'cv2': cv2.__version__,
+                         'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+              'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}
+    prev = json.load(open(args.compare))['results'] if args.compare else {}
+    print("%-28s %10s %10s %12s %10s"%("stage", "frames/s", "MB/s", "peak mem MB", "speedup" if prev else ""))
+    for stage, r in results.items():
+        speedup = "%.2fx"%(r['frames_per_s']/prev[stage]['frames_per_s']) if stage in prev else ""
+        print("%-28s %10.2f %10.2f %12.1f %10s"%(stage, r['frames_per_s'], r['mb_per_s'], r['peak_mem_mb'], speedup))
+    if args.output:
+        json.dump(report, open(args.output, 'w'), indent=1)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(bench_main())
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# manifest of finished conversion outputs allowing resumable/incremental runs of pano2sem.py and remap_coco.py
+# each frame is stored with a fingerprint of its input mask content and all parameters influencing its outputs;
+# frames with unchanged fingerprint and existing outputs are skipped on reruns
+# see https://github.com/ozendelait/wilddash_scripts
+#
+# Use this tool on your own risk!
+# Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
+# All rights reserved.
+#******************************************************************************
+
+import os
+import json
+import time
+import hashlib
+
+manifest_version = 1
+
+def manifest_load(manifest_path):
+    if os.path.exists(manifest_path):
+        try:
+            manifest = json.load(open(manifest_path))
+            if manifest.get('version') == manifest_version:
+                return manifest
+        except ValueError:
+            print("Warning: ignoring broken manifest "+manifest_path)
+    return {'version': manifest_version, 'frames': {}}
+
+#atomic write; only every min_interval seconds unless min_interval is 0
+def manifest_save(manifest, manifest_path, min_interval=0):
+    now = time.time()
+    if min_interval > 0 and now - manifest.get('_last_save', 0) < min_interval:
+        return
+    manifest['_last_save'] = now
+    with open(manifest_path+'.tmp', 'w') as ofile:
+        json.dump({k: v for k, v in manifest.items() if not k.startswith('_')}, ofile)
+    os.replace(manifest_path+'.tmp', manifest_path)
+
+#fingerprint of json-serializable parameters (e.g. label policy, category mapping, output directories)
+def params_fingerprint(*params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+#fingerprint of one frame: input mask content (bytes) combined with its parameters
+def frame_fingerprint(mask_data, *params):
+    h = hashlib.sha1(mask_data)
+    h.update(params_fingerprint(*params).encode('utf-8'))
+    return h.hexdigest()
+
+#true if all outputs of a frame exist and its fingerprint matches the manifest entry
+def frame_up_to_date(fingerprint, old_fingerprint, out_paths):
+    return fingerprint == old_fingerprint and all(os.path.exists(p) for p in out_paths)
@@ -7,6 +7,9 @@
 # cats_overwrite_trainids(cats, id2trainid) # optional: id2trainid contains custom mapping of id -> trainId
 # with open('labels_new.py','w') as ofile:
 #     ofile.writelines(cat2labelpy(cats))
+# labelids2trainids('sem_labelids/', 'sem_trainids/', cats, outp_dir_color='sem_color/', workers=8) # bulk conversion of uint8 label pngs
+#
+# commandline: python cscats_labelspy.py --cats_path labels.py --input_dir sem_labelids/ --output_dir sem_trainids/ --workers 8
 #
 # see https://github.com/ozendelait/wilddash_scripts
 # by Oliver Zendel, AIT Austrian Institute of Technology GmbH
@@ -15,7 +18,18 @@
 # Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
 # All rights reserved.
 #******************************************************************************
+import os
+import sys
 import json
+import argparse
+try:
+    import cv2
+    import numpy as np
+    from pano2sem import pool_imap, tqdm_none, tqdm_nb, tqdm_con
+except ImportError:
+    #label image conversion (labelids2trainids) needs opencv and numpy
+    cv2 = np = None
+    tqdm_nb = tqdm_con = None
 
 # loads categories from json compatible with coco panoptic format
 # as well as Mapillary Vistas/Wilddash2 meta json files
@@ -38,7 +52,7 @@ def cats_overwrite_trainids(cats, id2trainid):
             cat['train_id'] = 255 if idcat >= 0 else -1
             cat['evaluate'] = False
             continue
-        cat['train_id'] = id2trainid[id0]
+        cat['train_id'] = id2trainid[idcat]
         cat['evaluate'] = cat['train_id'] >= 0 and idcat < cat['train_id']
     
 # loads categories from python label structure compatible with Cityscapes-scripts file
@@ -82,4 +96,105 @@ def cat2labelpy(cats):
             is_inst_str = str(cat.get('instances', cat.get('isthing',False))),
             is_ignor_eval = str(not cat.get('evaluate', True)),
             col = cat['color'])
-    return ret_str+']\n'
\ No newline at end of file
+    return ret_str+']\n'
+
+# 256-entry uint8 lookup table label id -> train id; ids without category and negative/too large train ids map to ignore_id
+def cats_trainid_lut(cats, ignore_id=255):
+    lut = np.full(256, ignore_id, dtype=np.uint8)
+    for id0, cat in enumerate(cats):
+        idcat, train_id = cat.get('id', id0), cat.get('train_id', -1)
+        if 0 <= idcat < 256:
+            lut[idcat] = train_id if 0 <= train_id < 256 else ignore_id
+    return lut
+
+# 256-entry BGR lookup table label id -> color (RGB 'color' of the first category with the same train id in lut);
+# ids mapped to ignore_id are black
+def cats_color_lut(cats, lut, ignore_id=255):
+    trainid_color = {}
+    for id0, cat in enumerate(cats):
+        idcat = cat.get('id', id0)
+        if 0 <= idcat < 256 and lut[idcat] != ignore_id:
+            trainid_color.setdefault(int(lut[idcat]), cat['color'])
+    col_lut = np.zeros((256, 1, 3), dtype=np.uint8)
+    for id0 in range(256):
+        col_lut[id0, 0] = trainid_color.get(int(lut[id0]), [0, 0, 0])[::-1]
+    return col_lut
+
+def _labelids2trainids_file(ctx, rel_path):
+    labels = cv2.imread(os.path.join(ctx['inp_dir'], rel_path), cv2.IMREAD_UNCHANGED)
+    if labels is None or labels.dtype != np.uint8 or labels.ndim != 2:
+        return "no uint8 label image"
+    rel_out = rel_path[:-len(ctx['inp_postfix'])] if ctx['inp_postfix'] and rel_path.endswith(ctx['inp_postfix']) else os.path.splitext(rel_path)[0]
+    for outp_dir, postfix, img in [(ctx['outp_dir'], ctx['outp_postfix'], lambda: cv2.LUT(labels, ctx['lut'])),
+                                   (ctx['outp_dir_color'], ctx['color_postfix'], lambda: cv2.LUT(cv2.cvtColor(labels, cv2.COLOR_GRAY2BGR), ctx['col_lut']))]:
+        if not outp_dir:
+            continue
+        outp_path = os.path.join(outp_dir, rel_out+postfix)
+        os.makedirs(os.path.dirname(outp_path), exist_ok=True)
+        if not cv2.imwrite(outp_path, img()):
+            return "failed writing "+outp_path
+    return None
+
+# converts all uint8 label pngs (*inp_postfix, searched recursively) in inp_dir to train id pngs in outp_dir
+# and/or color pngs in outp_dir_color using the lookup tables of cats (see cats_trainid_lut, cats_color_lut)
+# the folder structure is kept; returns number of converted files
+def labelids2trainids(inp_dir, outp_dir, cats, outp_dir_color=None, ignore_id=255, inp_postfix='_labelIds.png', outp_postfix='_trainIds.png',
+                      color_postfix='_color.png', workers=1, tqdm_vers=tqdm_nb, ret_failures=None):
+    rel_paths = sorted(os.path.relpath(os.path.join(root, f), inp_dir) for root, _, files in os.walk(inp_dir)
+                       for f in files if f.endswith(inp_postfix or '.png'))
+    lut = cats_trainid_lut(cats, ignore_id=ignore_id)
+    ctx = {'inp_dir': inp_dir, 'outp_dir': outp_dir, 'outp_dir_color': outp_dir_color, 'lut': lut,
+           'col_lut': cats_color_lut(cats, lut, ignore_id=ignore_id) if outp_dir_color else None,
+           'inp_postfix': inp_postfix, 'outp_postfix': outp_postfix, 'color_postfix': color_postfix}
+    cnt_success = 0
+    for rel_path, err in tqdm_vers(pool_imap(_labelids2trainids_file, rel_paths, workers=workers, ctx=ctx), total=len(rel_paths)):
+        if err is None:
+            cnt_success += 1
+        elif not ret_failures is None:
+            ret_failures.append((rel_path, err))
+    return cnt_success
+
+# loads categories from a labels.py file or a json file (see labelpy2cats, cocojson2cats)
+def load_cats(cats_path):
+    return labelpy2cats(cats_path) if cats_path.endswith('.py') else cocojson2cats(cats_path)
+
+def labelids2trainids_main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cats_path', type=str, default="labels.py",
+                        help="Category meta data: Cityscapes-style labels.py or COCO panoptic/Mapillary Vistas json")
+    parser.add_argument('--id2trainid', type=str, default=None,
+                        help="Optional json with custom mapping of id -> trainId (overwrites trainIds of cats_path)")
+    parser.add_argument('--input_dir', type=str, default=None,
+                        help="Directory of uint8 label id pngs (e.g. --outp_dir_sem of pano2sem.py)")
+    parser.add_argument('--output_dir', type=str, default=None, help="Target directory for uint8 train id pngs")
+    parser.add_argument('--output_color_dir', type=str, default=None, help="Optional target directory for color-coded pngs")
+    parser.add_argument('--input_postfix', type=str, default='_labelIds.png', help="Only convert files ending with this postfix")
+    parser.add_argument('--output_postfix', type=str, default='_trainIds.png', help="Postfix replacing input_postfix for train id pngs")
+    parser.add_argument('--color_postfix', type=str, default='_color.png', help="Postfix replacing input_postfix for color pngs")
+    parser.add_argument('--ignore_id', type=int, default=255, help="Train id of all ignored/unknown label ids")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes for parallel conversion")
+    parser.add_argument('--silent', action='store_true', help="Suppress all outputs")
+    parser.add_argument('--verbose', action='store_true', help="Print extra information")
+    args = parser.parse_args(argv)
+    if not args.input_dir or (not args.output_dir and not args.output_color_dir):
+        if not args.silent:
+            print("Error: input_dir and output_dir/output_color_dir are needed.")
+        return -1
+    if cv2 is None:
+        print("Error: label image conversion needs opencv-python and numpy.")
+        return -1
+    cats = load_cats(args.cats_path)
+    if args.id2trainid:
+        cats_overwrite_trainids(cats, {int(k): v for k, v in json.load(open(args.id2trainid)).items()})
+    failures = []
+    cnt_success = labelids2trainids(args.input_dir, args.output_dir, cats, outp_dir_color=args.output_color_dir, ignore_id=args.ignore_id,
+                                    inp_postfix=args.input_postfix, outp_postfix=args.output_postfix, color_postfix=args.color_postfix,
+                                    workers=args.workers, tqdm_vers=tqdm_none if args.silent else tqdm_con, ret_failures=failures)
+    if not args.silent:
+        print("Finished converting label pngs with %i successes and %i failures."%(cnt_success, len(failures)))
+        if args.verbose and len(failures) > 0:
+            print("Generated these failures: ", failures)
+    return -2 if len(failures) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(labelids2trainids_main())
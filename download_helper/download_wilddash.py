@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# parallel downloader for wilddash.cc datasets (alternative to download_wilddash_file.sh)
+# uses the same CSRF login/cookie flow (credentials from WILDDASH_USERNAME/WILDDASH_PASSWORD, session in wd_cookies_downl.txt)
+# but downloads multiple files concurrently and splits large files into parallel HTTP Range chunks;
+# interrupted downloads resume per chunk (<file>.part + <file>.part.json); size (and optionally sha256) are verified at the end
+# see https://github.com/ozendelait/wilddash_scripts
+#
+# By using this script, you agree to the license agreement of the downloaded datasets:
+# https://wilddash.cc/license/wilddash
+# https://wilddash.cc/license/railsem19
+#
+# Use this tool on your own risk!
+# Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
+# All rights reserved.
+#******************************************************************************
+
+import os
+import re
+import sys
+import ssl
+import json
+import time
+import hashlib
+import argparse
+import threading
+import http.cookiejar
+import urllib.parse
+import urllib.request
+import concurrent.futures
+
+try:
+    from tqdm import tqdm as tqdm_con
+except:
+    #install/update tqdm needed
+    tqdm_con = None
+
+dataset_files = {'wilddash2': ['wd_public_v2p0.zip', 'wd_both_02.zip'], 'railsem19': ['rs19_val.zip']}
+block_size = 1 << 20
+read_size = 1 << 16 #bytes per socket read (state is saved every block_size bytes)
+
+class progress_none:
+    def __init__(self, *args, **kwargs):
+        pass
+    def update(self, n):
+        pass
+    def close(self):
+        pass
+
+def new_opener(cookie_jar, check_certificate=True):
+    ctx = ssl.create_default_context()
+    if not check_certificate:
+        ctx.check_hostname, ctx.verify_mode = False, ssl.CERT_NONE
+    return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookie_jar), urllib.request.HTTPSHandler(context=ctx))
+
+#login to the wilddash.cc webpage (get CSRF token, post credentials) and save the session cookies to cookie_path;
+#an existing cookie file is reused (delete it if downloads fail)
+def wilddash_login(server_url, cookie_path, username=None, password=None, check_certificate=True, verbose=True):
+    cookie_jar = http.cookiejar.MozillaCookieJar(cookie_path)
+    opener = new_opener(cookie_jar, check_certificate)
+    if os.path.exists(cookie_path):
+        try:
+            cookie_jar.load(ignore_discard=True, ignore_expires=True)
+            if verbose:
+                print("Restarting download with existing session. If this fails, manually delete %s and retry."%cookie_path)
+            return opener
+        except http.cookiejar.LoadError:
+            print("Warning: ignoring unreadable cookie file "+cookie_path)
+    username = username or os.environ.get('WILDDASH_USERNAME')
+    password = password or os.environ.get('WILDDASH_PASSWORD')
+    if not username or not password:
+        raise ValueError("Credentials missing: define WILDDASH_USERNAME and WILDDASH_PASSWORD")
+    account_url = server_url+'/accounts/login'
+    #start session to get CSRF token
+    page = opener.open(account_url, timeout=30).read().decode('utf-8', errors='replace')
+    csrf = re.search(r"""name=["']csrfmiddlewaretoken["'][^>]*value=["']([^"']*)["']""", page)
+    if csrf is None:
+        raise IOError("No CSRF token found at "+account_url)
+    userdata = urllib.parse.urlencode({'username': username, 'password': password, 'csrfmiddlewaretoken': csrf.group(1), 'submit': 'Login'}).encode('ascii')
+    req = urllib.request.Request(account_url, data=userdata, headers={'Referer': account_url})
+    opener.open(req, timeout=30).read()
+    cookie_jar.save(ignore_discard=True, ignore_expires=True)
+    return opener
+
+#file name from a Content-Disposition header (as wget --content-disposition), fallback: last part of the url
+def response_file_name(resp, url):
+    disp = resp.headers.get('Content-Disposition', '')
+    name = re.search(r"""filename\*?=(?:UTF-8'')?["']?([^"';]+)""", disp)
+    name = urllib.parse.unquote(name.group(1)) if name else urllib.parse.unquote(urllib.parse.urlparse(url).path.rsplit('/', 1)[-1])
+    return os.path.basename(name)
+
+#request first byte of url; returns (file name, total size or None, True if Range requests are supported)
+def probe_download(opener, url, timeout=30):
+    resp = opener.open(urllib.request.Request(url, headers={'Range': 'bytes=0-0'}), timeout=timeout)
+    try:
+        if resp.headers.get('Content-Type', '').startswith('text/html'):
+            raise IOError("Server returned a html page instead of %s (not logged in or file not found?)"%url)
+        name = response_file_name(resp, url)
+        content_range = re.match(r"bytes\s+0-0/(\d+)", resp.headers.get('Content-Range', ''))
+        if resp.status == 206 and content_range:
+            return name, int(content_range.group(1)), True
+        size = resp.headers.get('Content-Length')
+        return name, int(size) if size else None, False
+    finally:
+        resp.close()
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as ifile:
+        for block in iter(lambda: ifile.read(block_size*8), b''):
+            h.update(block)
+    return h.hexdigest()
+
+#read sha256sum-style checksum file ("<hex>  <file name>" per line) into dict file name -> hex
+def load_checksums(path):
+    ret = {}
+    for line in open(path):
+        parts = line.strip().split()
+        if len(parts) >= 2:
+            ret[os.path.basename(parts[-1].lstrip('*'))] = parts[0].lower()
+    return ret
+
+#download state of a chunked download: bytes already written per chunk (atomic save)
+class ChunkState:
+    def __init__(self, state_path, url, size, chunk_size):
+        self.path, self.lock = state_path, threading.Lock()
+        self.state = {'url': url, 'size': size, 'chunk_size': chunk_size, 'done': [0]*((size+chunk_size-1)//chunk_size)}
+        if os.path.exists(state_path):
+            try:
+                old = json.load(open(state_path))
+                if all(old.get(k) == self.state[k] for k in ['url', 'size', 'chunk_size']) and len(old['done']) == len(self.state['done']):
+                    self.state = old
+            except ValueError:
+                pass #broken state file; restart download
+
+    def chunk_range(self, i):
+        start = i*self.state['chunk_size']
+        return start, min(start+self.state['chunk_size'], self.state['size'])
+
+    def done(self, i):
+        return self.state['done'][i]
+
+    def add(self, i, n, save=False):
+        with self.lock:
+            self.state['done'][i] += n
+            if save:
+                self.save()
+
+    def save(self):
+        with open(self.path+'.tmp', 'w') as ofile:
+            json.dump(self.state, ofile)
+        os.replace(self.path+'.tmp', self.path)
+
+    def bytes_done(self):
+        return sum(self.state['done'])
+
+    def complete(self):
+        return all(self.done(i) == self.chunk_range(i)[1]-self.chunk_range(i)[0] for i in range(len(self.state['done'])))
+
+#download missing bytes of chunk i into part_path (resumes at the last saved position); retries on errors
+def download_chunk(opener, url, part_path, state, i, progress, retries=10, timeout=20, save_every=block_size):
+    start, end = state.chunk_range(i)
+    for attempt in range(retries+1):
+        pos = start+state.done(i)
+        if pos >= end:
+            return
+        unsaved = 0
+        try:
+            resp = opener.open(urllib.request.Request(url, headers={'Range': 'bytes=%i-%i'%(pos, end-1)}), timeout=timeout)
+            with resp, open(part_path, 'r+b') as ofile:
+                if resp.status != 206:
+                    raise IOError("Server ignored range request (status %i)"%resp.status)
+                ofile.seek(pos)
+                while pos < end:
+                    data = resp.read(min(read_size, end-pos))
+                    if not data:
+                        raise IOError("Connection closed at byte %i"%pos)
+                    ofile.write(data)
+                    pos += len(data)
+                    unsaved += len(data)
+                    progress.update(len(data))
+                    if unsaved >= save_every:
+                        ofile.flush()
+                        state.add(i, unsaved, save=True)
+                        unsaved = 0
+                ofile.flush()
+                state.add(i, unsaved, save=True)
+            return
+        except Exception:
+            progress.update(-unsaved) #bytes since the last save are downloaded again
+            if attempt == retries:
+                raise
+            time.sleep(min(1.0*(attempt+1), 10.0))
+
+#download url into dst_dir using up to chunk_workers parallel Range requests of chunk_size bytes
+#returns path of the downloaded file; raises on errors or failed verification (size, sha256 if checksums contains the file name)
+def download_file(opener, url, dst_dir, chunk_workers=4, chunk_size=64*block_size, checksums={}, retries=10, progress_vers=progress_none):
+    name, size, ranged = probe_download(opener, url)
+    dst_path = os.path.join(dst_dir, name)
+    part_path, state_path = dst_path+'.part', dst_path+'.part.json'
+    if os.path.exists(dst_path) and (size is None or os.path.getsize(dst_path) == size) and not os.path.exists(part_path):
+        verify_file(dst_path, size, checksums.get(name))
+        return dst_path
+    progress = progress_vers(total=size, unit='B', unit_scale=True, desc=name)
+    try:
+        if ranged and size > 0:
+            state = ChunkState(state_path, url, size, chunk_size)
+            if not os.path.exists(part_path) or os.path.getsize(part_path) != size:
+                with open(part_path, 'wb') as ofile:
+                    ofile.truncate(size)
+                state.state['done'] = [0]*len(state.state['done'])
+            state.save()
+            progress.update(state.bytes_done())
+            with concurrent.futures.ThreadPoolExecutor(chunk_workers) as pool:
+                jobs = [pool.submit(download_chunk, opener, url, part_path, state, i, progress, retries) for i in range(len(state.state['done']))]
+                for job in jobs:
+                    job.result()
+            if not state.complete():
+                raise IOError("Incomplete download of "+name)
+        else:
+            #no range support: single stream without resume
+            for attempt in range(retries+1):
+                written = 0
+                try:
+                    with opener.open(url, timeout=20) as resp, open(part_path, 'wb') as ofile:
+                        for data in iter(lambda: resp.read(block_size), b''):
+                            ofile.write(data)
+                            written += len(data)
+                            progress.update(len(data))
+                    if not size is None and written != size:
+                        raise IOError("Connection closed at byte %i"%written)
+                    break
+                except Exception:
+                    progress.update(-written)
+                    if attempt == retries:
+                        raise
+                    time.sleep(min(1.0*(attempt+1), 10.0))
+    finally:
+        progress.close()
+    try:
+        verify_file(part_path, size, checksums.get(name))
+    except IOError:
+        #corrupt data: restart this file from scratch on the next run
+        for p in [part_path, state_path]:
+            if os.path.exists(p):
+                os.remove(p)
+        raise
+    os.replace(part_path, dst_path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return dst_path
+
+def verify_file(path, size=None, sha256=None):
+    if not size is None and os.path.getsize(path) != size:
+        raise IOError("Size mismatch of %s: %i != %i"%(path, os.path.getsize(path), size))
+    if sha256 and sha256_file(path) != sha256.lower():
+        raise IOError("Checksum mismatch of "+path)
+
+#download all file_names from server_url/download/ into dst_dir (parallel_files files at once)
+#returns list of (file name, downloaded path or None, error message or None)
+def download_wilddash_files(file_names, dst_dir, server_url='https://wilddash.cc', parallel_files=2, chunk_workers=4, chunk_size=64*block_size,
+                            checksums={}, retries=10, check_certificate=True, progress_vers=progress_none, verbose=True):
+    if not os.path.exists(dst_dir):
+        os.makedirs(dst_dir)
+    opener = wilddash_login(server_url, os.path.join(dst_dir, 'wd_cookies_downl.txt'), check_certificate=check_certificate, verbose=verbose)
+    def downl(file_name):
+        try:
+            return file_name, download_file(opener, server_url+'/download/'+file_name, dst_dir, chunk_workers=chunk_workers, chunk_size=chunk_size,
+                                            checksums=checksums, retries=retries, progress_vers=progress_vers), None
+        except Exception as e:
+            return file_name, None, str(e)
+    with concurrent.futures.ThreadPoolExecutor(max(1, parallel_files)) as pool:
+        return list(pool.map(downl, file_names))
+
+def downl_main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file_names', type=str, nargs='*', help="Names of wilddash.cc files to download (e.g. wd_public_v2p0.zip)")
+    parser.add_argument('--dataset', type=str, default=None, choices=list(dataset_files.keys()), help="Download all files of this dataset")
+    parser.add_argument('--dst_dir', type=str, default='./', help="Target directory")
+    parser.add_argument('--parallel_files', type=int, default=2, help="Number of files downloaded at the same time")
+    parser.add_argument('--chunk_workers', type=int, default=4, help="Number of parallel Range requests per file")
+    parser.add_argument('--chunk_size_mb', type=int, default=64, help="Size of Range chunks in MB")
+    parser.add_argument('--checksums', type=str, default=None, help="Optional sha256sum-style checksum file used to verify the downloads")
+    parser.add_argument('--retries', type=int, default=10, help="Retries per chunk")
+    parser.add_argument('--server_url', type=str, default='https://wilddash.cc', help="wilddash.cc server url")
+    parser.add_argument('--no_check_certificate', action='store_true', help="Do not verify the server certificate (as wget --no-check-certificate)")
+    parser.add_argument('--silent', action='store_true', help="Suppress all outputs")
+    args = parser.parse_args(argv)
+    file_names = args.file_names + dataset_files.get(args.dataset, [])
+    if len(file_names) == 0:
+        print("Error: no files selected.")
+        return -1
+    progress_vers = progress_none if args.silent or tqdm_con is None else tqdm_con
+    results = download_wilddash_files(file_names, args.dst_dir, server_url=args.server_url.rstrip('/'), parallel_files=args.parallel_files,
+                                      chunk_workers=args.chunk_workers, chunk_size=args.chunk_size_mb*block_size,
+                                      checksums=load_checksums(args.checksums) if args.checksums else {}, retries=args.retries,
+                                      check_certificate=not args.no_check_certificate, progress_vers=progress_vers, verbose=not args.silent)
+    failures = [r for r in results if not r[2] is None]
+    if not args.silent:
+        for file_name, path, err in results:
+            print("Downloaded %s"%path if err is None else "Failed to download %s: %s"%(file_name, err))
+    return -2 if len(failures) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(downl_main())
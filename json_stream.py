@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# helper for reading/writing very large (panoptic COCO) json files with bounded memory
+# top-level arrays (e.g. "images", "annotations") are read and written one entry at a time
+# see https://github.com/ozendelait/wilddash_scripts
+#
+# example:
+# meta = json_load_skip('panoptic.json', ['annotations'])
+# with JsonStreamWriter('remapped.json', meta, 'annotations') as writer:
+#     for a in json_iter_items('panoptic.json', 'annotations'):
+#         writer.write_item(a)
+#
+# Use this tool on your own risk!
+# Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
+# All rights reserved.
+#******************************************************************************
+
+import os
+import json
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+# yields ('value', key, value) for every top-level entry of a json object file
+# top-level arrays are not loaded as a whole: ('array', key, None) is followed by one ('item', key, item) per entry
+def json_iter_events(json_path, chunk_size=1<<20):
+    with open(json_path) as ifile:
+        buf, pos, eof = '', 0, False
+        def fill(min_read):
+            nonlocal buf, pos, eof
+            new_data = ifile.read(max(min_read, chunk_size))
+            eof = len(new_data) == 0
+            buf, pos = buf[pos:] + new_data, 0
+        def next_char():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in _whitespace:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    break
+                fill(chunk_size)
+            if pos >= len(buf):
+                raise ValueError("Unexpected end of json file "+json_path)
+            return buf[pos]
+        def decode():
+            nonlocal pos
+            next_char()
+            read_size = chunk_size
+            while True:
+                try:
+                    val, end = _decoder.raw_decode(buf, pos)
+                    #values touching the end of the buffer could be truncated (e.g. numbers)
+                    if end < len(buf) or eof:
+                        pos = end
+                        return val
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill(read_size)
+                read_size *= 2
+        def expect(chars):
+            nonlocal pos
+            c = next_char()
+            if not c in chars:
+                raise ValueError("Invalid json file "+json_path+": expected "+chars+" got "+c)
+            pos += 1
+            return c
+        expect('{')
+        if next_char() == '}':
+            return
+        while True:
+            key = decode()
+            expect(':')
+            if next_char() == '[':
+                yield 'array', key, None
+                pos += 1
+                if next_char() == ']':
+                    pos += 1
+                else:
+                    while True:
+                        yield 'item', key, decode()
+                        if expect(',]') == ']':
+                            break
+            else:
+                yield 'value', key, decode()
+            if expect(',}') == '}':
+                break
+
+# yields all entries of the top-level array key one by one
+def json_iter_items(json_path, key):
+    for ev, key0, val in json_iter_events(json_path):
+        if ev == 'item' and key0 == key:
+            yield val
+
+# loads a json object file except for the top-level entries in skip_keys (these are set to None to keep the key order)
+def json_load_skip(json_path, skip_keys):
+    ret = {}
+    for ev, key0, val in json_iter_events(json_path):
+        if key0 in skip_keys:
+            ret[key0] = None
+        elif ev == 'array':
+            ret[key0] = []
+        elif ev == 'item':
+            ret[key0].append(val)
+        else:
+            ret[key0] = val
+    return ret
+
+# writes a json object entry by entry with output identical to json.dump(obj, open(json_path,'w'))
+# the entries of the top-level array stream_key are supplied one at a time using write_item
+# the file is written to a temporary path and renamed in close() (also allows json_path to be the streamed input file)
+class JsonStreamWriter:
+    def __init__(self, json_path, obj, stream_key):
+        self.json_path, self.tmp_path = json_path, json_path+'.tmp'
+        keys = list(obj.keys())
+        if not stream_key in keys:
+            keys.append(stream_key)
+        idx = keys.index(stream_key)
+        self.ofile = open(self.tmp_path, 'w')
+        self.ofile.write('{'+''.join(self._entry(k, obj[k])+', ' for k in keys[:idx])+json.dumps(stream_key)+': [')
+        self.suffix = ']'+''.join(', '+self._entry(k, obj[k]) for k in keys[idx+1:])+'}'
+        self.num_items = 0
+    @staticmethod
+    def _entry(k, v):
+        return json.dumps(k)+': '+json.dumps(v)
+    def write_item(self, item):
+        self.ofile.write((', ' if self.num_items > 0 else '')+json.dumps(item))
+        self.num_items += 1
+    def close(self):
+        self.ofile.write(self.suffix)
+        self.ofile.close()
+        os.replace(self.tmp_path, self.json_path)
+    # discard the output: closes and removes the temporary file (json_path is not changed)
+    def abort(self):
+        self.ofile.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
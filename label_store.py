@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# memory-mapped chunked store of label maps (semantic uint8, instance uint16, panoptic ids uint32) for training dataloaders
+# a store is a directory <name>.lstore containing index.json and chunk files chunk_<n>.bin with the raw (uncompressed) arrays;
+# readers get zero-copy read-only views into memory maps of the chunk files (no png decoding, no small-file I/O per frame)
+# pano2sem.py/remap_coco.py write into a store if an output path has the form <name>.lstore[/<folder>]
+# (frames are named like the png files they replace, e.g. sem/frame_0001_labelIds.png)
+#
+# example:
+# store = LabelStore('wd2_labels.lstore')
+# semantic = store['sem/frame_0001_labelIds.png']  # numpy view, valid as long as store is open
+#
+# commandline (convert existing png directories):
+# python label_store.py --input_dir sem_labelids/ --output wd2_labels.lstore/sem --append
+#
+# see https://github.com/ozendelait/wilddash_scripts
+#
+# Use this tool on your own risk!
+# Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
+# All rights reserved.
+#******************************************************************************
+
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+import cv2
+import numpy as np
+from pano_codec import default_codec
+
+try:
+    from tqdm import tqdm as tqdm_con
+except:
+    #install/update tqdm needed
+    tqdm_con = None
+
+index_name = 'index.json'
+default_chunk_mb = 256
+align_bytes = 64
+
+#split p into (store path, member path) if p points into a label store (<name>.lstore or <name>.lstore/<member>)
+def split_store_path(p):
+    p = p.replace('\\', '/')
+    pos = p.lower().find('.lstore/')
+    if pos >= 0:
+        return p[:pos+7], p[pos+8:]
+    if p.lower().endswith('.lstore'):
+        return p, ''
+    return None, p
+
+def is_store_path(p):
+    return not p is None and not split_store_path(p)[0] is None
+
+#True if p points into a label store which exists already
+def is_existing_store(p):
+    store_path = split_store_path(p)[0] if not p is None else None
+    return not store_path is None and os.path.exists(os.path.join(store_path, index_name))
+
+def chunk_path(store_path, chunk):
+    return os.path.join(store_path, 'chunk_%05i.bin'%chunk)
+
+#appends frames to a label store; chunk files are filled up to chunk_size bytes, the index is written on close
+#append=False: an existing store is replaced; frames added again with the same name replace the old entry
+class LabelStoreWriter:
+    def __init__(self, path, chunk_size=default_chunk_mb << 20, append=False):
+        self.path, self.chunk_size = path, chunk_size
+        self.index = {'version': 1, 'num_chunks': 0, 'frames': {}}
+        index_path = os.path.join(path, index_name)
+        if append and os.path.exists(index_path):
+            self.index = json.load(open(index_path))
+        elif os.path.isdir(path):
+            for f in os.listdir(path):
+                if f == index_name or (f.startswith('chunk_') and f.endswith('.bin')):
+                    os.remove(os.path.join(path, f))
+        else:
+            os.makedirs(path)
+        self._file, self._size = None, 0
+
+    def _next_chunk(self):
+        if not self._file is None:
+            self._file.close()
+        self._file, self._size = open(chunk_path(self.path, self.index['num_chunks']), 'wb'), 0
+        self.index['num_chunks'] += 1
+
+    def add(self, name, arr):
+        arr = np.ascontiguousarray(arr)
+        if self._file is None or (self._size > 0 and self._size+arr.nbytes > self.chunk_size):
+            self._next_chunk()
+        offset = (self._size+align_bytes-1)//align_bytes*align_bytes
+        self._file.write(b'\0'*(offset-self._size))
+        self._file.write(arr.reshape(-1).view(np.uint8).data)
+        self._size = offset+arr.nbytes
+        self.index['frames'][name] = [self.index['num_chunks']-1, offset, list(arr.shape), arr.dtype.str]
+
+    def close(self):
+        if not self._file is None:
+            self._file.close()
+            self._file = None
+        index_path = os.path.join(self.path, index_name)
+        with open(index_path+'.tmp', 'w') as ofile:
+            json.dump(self.index, ofile)
+        os.replace(index_path+'.tmp', index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#random-access reader of a label store; store[name] returns a read-only numpy view into the memory-mapped chunk file
+#picklable (e.g. for dataloader worker processes): memory maps are reopened per process
+class LabelStore:
+    def __init__(self, path):
+        self.path = path
+        self.index = json.load(open(os.path.join(path, index_name)))
+        self._maps, self._pid = {}, os.getpid()
+
+    def __getstate__(self):
+        return {'path': self.path, 'index': self.index}
+
+    def __setstate__(self, state):
+        self.path, self.index = state['path'], state['index']
+        self._maps, self._pid = {}, os.getpid()
+
+    def _chunk(self, chunk):
+        if self._pid != os.getpid():
+            self._maps, self._pid = {}, os.getpid()
+        if not chunk in self._maps:
+            self._maps[chunk] = np.memmap(chunk_path(self.path, chunk), dtype=np.uint8, mode='r')
+        return self._maps[chunk]
+
+    def names(self):
+        return list(self.index['frames'].keys())
+
+    def __len__(self):
+        return len(self.index['frames'])
+
+    def __contains__(self, name):
+        return name in self.index['frames']
+
+    def __getitem__(self, name):
+        chunk, offset, shape, dtype = self.index['frames'][name]
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._chunk(chunk), offset=offset)
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+#reads a label png for the store: 1-channel images (uint8 semantic, uint16 instance) are kept,
+#3-channel panoptic BGR masks are converted to uint32 ids (unless keep_bgr)
+def read_label_png(path, keep_bgr=False):
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None or img.ndim == 2 or keep_bgr:
+        return img
+    if img.ndim != 3 or img.shape[2] != 3 or img.dtype != np.uint8:
+        raise ValueError("unsupported label image %s"%path)
+    return default_codec.decode(img).copy()
+
+def _read_label_png_task(task):
+    path, keep_bgr = task
+    try:
+        img = read_label_png(path, keep_bgr)
+        return (None, img) if not img is None else ("could not read "+path, None)
+    except Exception as e:
+        return str(e), None
+
+#converts all pngs (*postfix, searched recursively) of inp_dir into the store output (<name>.lstore[/<folder>]);
+#pngs are decoded by a pool of worker processes, frames are named by their path relative to inp_dir
+#an existing store is only changed with append (frames are added) or overwrite (the store is replaced), otherwise ValueError
+#returns list of (file name, error message) of all failures
+def pngs2store(inp_dir, output, postfix='.png', keep_bgr=False, append=False, overwrite=False, chunk_size=default_chunk_mb << 20, workers=1, tqdm_vers=None):
+    store_path, prefix = split_store_path(output)
+    if store_path is None:
+        raise ValueError("Output %s is no label store path (<name>.lstore[/<folder>])"%output)
+    if not append and not overwrite and is_existing_store(store_path):
+        raise ValueError("Label store %s exists already (use append to add frames or overwrite to replace it)"%store_path)
+    prefix = prefix.strip('/')+'/' if prefix.strip('/') else ''
+    rel_paths = sorted(os.path.relpath(os.path.join(root, f), inp_dir).replace('\\', '/') for root, _, files in os.walk(inp_dir)
+                       for f in files if f.endswith(postfix))
+    tasks = [(os.path.join(inp_dir, rel_path), keep_bgr) for rel_path in rel_paths]
+    failures = []
+    with LabelStoreWriter(store_path, chunk_size=chunk_size, append=append) as writer:
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            results = pool.imap(_read_label_png_task, tasks, chunksize=4) if pool else map(_read_label_png_task, tasks)
+            if not tqdm_vers is None:
+                results = tqdm_vers(results, total=len(tasks))
+            for rel_path, (err, img) in zip(rel_paths, results):
+                if err is None:
+                    writer.add(prefix+rel_path, img)
+                else:
+                    failures.append((rel_path, err))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+    return failures
+
+def label_store_main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_dir', type=str, default=None, help="Directory of label pngs (searched recursively)")
+    parser.add_argument('--output', type=str, default=None, help="Label store path (<name>.lstore, optionally with folder: <name>.lstore/sem)")
+    parser.add_argument('--postfix', type=str, default='.png', help="Only convert files ending with this postfix (e.g. _labelIds.png)")
+    parser.add_argument('--keep_bgr', action='store_true', help="Store 3-channel pngs as BGR images instead of panoptic uint32 ids")
+    parser.add_argument('--append', action='store_true', help="Add frames to an existing store")
+    parser.add_argument('--overwrite', action='store_true', help="Replace an existing store (without --append/--overwrite, existing stores are not changed)")
+    parser.add_argument('--chunk_size_mb', type=int, default=default_chunk_mb, help="Size of chunk files in MB")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes for png decoding")
+    parser.add_argument('--silent', action='store_true', help="Suppress all outputs")
+    parser.add_argument('--verbose', action='store_true', help="Print extra information")
+    args = parser.parse_args(argv)
+    if not args.input_dir or not is_store_path(args.output):
+        if not args.silent:
+            print("Error: input_dir and a label store output path (<name>.lstore) are needed.")
+        return -1
+    if not args.append and not args.overwrite and is_existing_store(args.output):
+        if not args.silent:
+            print("Error: label store %s exists already; use --append to add frames to it or --overwrite to replace it."%split_store_path(args.output)[0])
+        return -1
+    failures = pngs2store(args.input_dir, args.output, postfix=args.postfix, keep_bgr=args.keep_bgr, append=args.append, overwrite=args.overwrite,
+                          chunk_size=args.chunk_size_mb << 20, workers=args.workers, tqdm_vers=None if args.silent else tqdm_con)
+    if not args.silent:
+        print("Finished converting pngs into %s with %i failures."%(args.output, len(failures)))
+        if args.verbose and len(failures) > 0:
+            print("Generated these failures: ", failures)
+    return -2 if len(failures) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(label_store_main())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# read panoptic png masks from a directory or directly from a (downloaded) zip archive without extracting it
+# and optionally write outputs into zip archives (output paths of the form <archive>.zip/<member>)
+# or memory-mapped label stores (<name>.lstore/<member>, see label_store.py)
+# sources are picklable; each (worker) process opens its own zip file handle so members are read in parallel
+# zip/label store outputs can not be written by multiple processes: writes are deferred (see imwrite_mask) and
+# the main process stores them using DeferredOutputs
+#
+# example:
+# src = mask_source('wd2_public.zip/panoptic')  # or a directory or a zip archive (members are found by name)
+# bgr = src.imread('frame_0001.png')
+#
+# see https://github.com/ozendelait/wilddash_scripts
+#
+# Use this tool on your own risk!
+# Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
+# All rights reserved.
+#******************************************************************************
+
+import os
+import shutil
+import zipfile
+import cv2
+import numpy as np
+from stage_profile import prof_stage
+from pano_codec import default_codec
+from label_store import split_store_path, is_store_path, is_existing_store, LabelStoreWriter
+
+#split p into (zip archive path, member path) if p points into a zip archive (<archive>.zip or <archive>.zip/<member>)
+def split_zip_path(p):
+    p = p.replace('\\', '/')
+    pos = p.lower().find('.zip/')
+    if pos >= 0:
+        return p[:pos+4], p[pos+5:]
+    if p.lower().endswith('.zip'):
+        return p, ''
+    return None, p
+
+def is_zip_path(p):
+    return not p is None and not split_zip_path(p)[0] is None
+
+#outputs which are written by the main process (zip archives and label stores)
+def is_deferred_path(p):
+    return is_zip_path(p) or is_store_path(p)
+
+#single process mode with write-behind (see async_io.py): regular files are deferred as well
+_defer_files = False
+def defer_file_writes(enable=True):
+    global _defer_files
+    _defer_files = enable
+
+def is_deferred_write(p):
+    return _defer_files or is_deferred_path(p)
+
+def imdecode_data(data):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+class DirSource:
+    def __init__(self, root):
+        self.root = root
+
+    def is_valid(self):
+        return os.path.isdir(self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as ifile:
+            return ifile.read()
+
+    # cv2.imread of mask name; with a profile, file reading and png decoding are timed separately
+    def imread(self, name, prof=None):
+        if prof is None:
+            return cv2.imread(self.path(name))
+        with prof_stage(prof, 'fs_read'):
+            data = self.read(name)
+        with prof_stage(prof, 'png_decode'):
+            return imdecode_data(data)
+
+    # copy mask name unchanged to trg_path (deferred if trg_path points into a zip archive or label store)
+    def copy_to(self, name, trg_path, prof=None):
+        with prof_stage(prof, 'fs_copy'):
+            if is_deferred_write(trg_path):
+                defer_copy(trg_path, self.read(name))
+            else:
+                shutil.copy2(self.path(name), trg_path)
+
+# zip members are found at prefix+name; without prefix, names not found are looked up by their file name
+# (e.g. the mask folder inside an archive needs not to be known); the file handle is (re)opened lazily per process
+class ZipSource:
+    def __init__(self, zip_path, prefix=''):
+        self.zip_path, self.prefix = zip_path, prefix.strip('/')+'/' if prefix.strip('/') else ''
+        self._zip, self._pid, self._by_name = None, None, None
+
+    def __getstate__(self):
+        return {'zip_path': self.zip_path, 'prefix': self.prefix}
+
+    def __setstate__(self, state):
+        self.__init__(state['zip_path'])
+        self.prefix = state['prefix']
+
+    def zip(self):
+        if self._zip is None or self._pid != os.getpid():
+            self._zip, self._pid = zipfile.ZipFile(self.zip_path, 'r'), os.getpid()
+        return self._zip
+
+    def is_valid(self):
+        if not zipfile.is_zipfile(self.zip_path):
+            return False
+        return self.prefix == '' or any(n.startswith(self.prefix) for n in self.zip().namelist())
+
+    def member(self, name):
+        member = self.prefix+name.replace('\\', '/')
+        if self.prefix or member in self.zip().NameToInfo:
+            return member
+        if self._by_name is None:
+            by_name = {}
+            for n in self.zip().namelist():
+                by_name.setdefault(n.rsplit('/', 1)[-1], []).append(n)
+            self._by_name = by_name
+        found = self._by_name.get(name.rsplit('/', 1)[-1], [])
+        if len(found) != 1:
+            raise KeyError("%s member %s in %s"%("no" if len(found) == 0 else "ambiguous", name, self.zip_path))
+        return found[0]
+
+    def path(self, name):
+        return self.zip_path+'/'+self.member(name)
+
+    def read(self, name):
+        return self.zip().read(self.member(name))
+
+    def imread(self, name, prof=None):
+        with prof_stage(prof, 'fs_read'):
+            data = self.read(name)
+        with prof_stage(prof, 'png_decode'):
+            return imdecode_data(data)
+
+    def copy_to(self, name, trg_path, prof=None):
+        with prof_stage(prof, 'fs_copy'):
+            data = self.read(name)
+            if is_deferred_write(trg_path):
+                defer_copy(trg_path, data)
+            else:
+                with open(trg_path, 'wb') as ofile:
+                    ofile.write(data)
+
+_sources = {}
+#mask source for a directory, a zip archive or a folder within a zip archive (<archive>.zip/<folder>);
+#if the directory p does not exist but <p>.zip does, the archive is used
+def mask_source(p):
+    if not p in _sources:
+        zip_path, prefix = split_zip_path(p)
+        if zip_path is None and not os.path.isdir(p) and os.path.isfile(p.rstrip('/\\')+'.zip'):
+            zip_path, prefix = p.rstrip('/\\')+'.zip', ''
+        _sources[p] = DirSource(p) if zip_path is None else ZipSource(zip_path, prefix)
+    return _sources[p]
+
+#writes to zip archives (encoded file content) and label stores (arrays) of the current process
+#which still need to be stored by the main process (see DeferredOutputs)
+_deferred_writes = []
+def defer_write(path, data):
+    _deferred_writes.append((path, data))
+
+#copy of png mask file content: label stores get the decoded panoptic ids
+def defer_copy(path, data):
+    defer_write(path, default_codec.decode_png(data).copy() if is_store_path(path) else data)
+
+#returns and clears all deferred zip writes of the current process (call at the end of each worker task)
+def take_deferred_writes():
+    ret = list(_deferred_writes)
+    del _deferred_writes[:]
+    return ret
+
+#write encoded image img to path; paths within a zip archive are deferred (see DeferredOutputs)
+#label stores get the image array itself (no encoding)
+#with write-behind (defer_file_writes), the encoded images of regular files are deferred as well
+#with a profile, png encoding and file writing are timed separately
+def imwrite_mask(path, img, prof=None):
+    if is_store_path(path):
+        defer_write(path, np.array(img))
+        return True
+    if prof is None and not is_deferred_write(path):
+        return cv2.imwrite(path, img)
+    with prof_stage(prof, 'png_encode'):
+        ok, data = cv2.imencode(os.path.splitext(path)[1], img)
+    if ok:
+        if is_deferred_write(path):
+            defer_write(path, data.tobytes())
+        else:
+            with prof_stage(prof, 'fs_write'):
+                with open(path, 'wb') as ofile:
+                    ofile.write(data.tobytes())
+    return ok
+
+#write panoptic uint32 ids to path as BGR png mask; label stores get the ids themselves
+def write_pano_ids(path, ids, prof=None):
+    if is_store_path(path):
+        defer_write(path, np.array(ids))
+        return True
+    with prof_stage(prof, 'id_packing'):
+        msk = default_codec.encode(ids)
+    return imwrite_mask(path, msk, prof)
+
+#create output directory p (for zip archives/label stores: the directory containing them)
+def make_output_dir(p):
+    out_path = split_zip_path(p)[0] or split_store_path(p)[0]
+    p = os.path.dirname(os.path.abspath(out_path)) if not out_path is None else p
+    if p and not os.path.exists(p):
+        os.makedirs(p)
+
+#True if p points into a zip archive which exists already
+def is_existing_zip(p):
+    zip_path = split_zip_path(p)[0] if not p is None else None
+    return not zip_path is None and os.path.isfile(zip_path)
+
+#zip archives and label stores written by the main process; existing outputs are never replaced: frames are added to
+#label stores with append_stores (frames of the same name replace the old entries) and to zip archives with append_zips
+#(members of the same name are added again, readers get the last one), otherwise writing into them raises a ValueError;
+#zip members are stored uncompressed (png data is already compressed)
+#regular files (see defer_file_writes) are passed to writer (write-behind, see async_io.AsyncWriter) with tag
+#(e.g. frame name) or written directly without writer; take_errors returns (tag, error message) of failed writes,
+#take_done the tags whose writes are finished (immediately without writer)
+class DeferredOutputs:
+    def __init__(self, writer=None, append_stores=False, append_zips=False):
+        self.zips, self.stores, self.writer, self.done = {}, {}, writer, []
+        self.append_stores, self.append_zips = append_stores, append_zips
+
+    def write(self, writes, prof=None, tag=None):
+        with prof_stage(prof, 'deferred_write'):
+            files = [(path, data) for path, data in writes if not is_deferred_path(path)]
+            if len(files) > 0:
+                if self.writer is None:
+                    for path, data in files:
+                        with open(path, 'wb') as ofile:
+                            ofile.write(data)
+                else:
+                    self.writer.submit(files, tag)
+            for path, data in writes:
+                if not is_deferred_path(path):
+                    continue
+                store_path, member = split_store_path(path)
+                if not store_path is None:
+                    store_path = os.path.abspath(store_path)
+                    if not store_path in self.stores:
+                        if not self.append_stores and is_existing_store(store_path):
+                            raise ValueError("label store %s exists already (add frames with --append_store or remove it)"%store_path)
+                        self.stores[store_path] = LabelStoreWriter(store_path, append=self.append_stores)
+                    self.stores[store_path].add(member, data)
+                    continue
+                zip_path, member = split_zip_path(path)
+                zip_path = os.path.abspath(zip_path)
+                if not zip_path in self.zips:
+                    if not self.append_zips and is_existing_zip(zip_path):
+                        raise ValueError("zip archive %s exists already (add frames with --append_zip or remove it)"%zip_path)
+                    self.zips[zip_path] = zipfile.ZipFile(zip_path, 'a' if self.append_zips else 'w', zipfile.ZIP_STORED)
+                self.zips[zip_path].writestr(member, data)
+            if self.writer is None or len(files) == 0:
+                self.done.append(tag)
+
+    def take_errors(self):
+        return [] if self.writer is None else self.writer.take_errors()
+
+    def take_done(self):
+        ret, self.done = self.done, []
+        return ret+([] if self.writer is None else self.writer.take_done())
+
+    def close(self):
+        for z in list(self.zips.values())+list(self.stores.values()):
+            z.close()
+        self.zips, self.stores = {}, {}
+        if not self.writer is None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -9,13 +9,20 @@
 # All rights reserved.
 #******************************************************************************
 
-import cv2
 import numpy as np
-import os
 import sys
 import glob
 import json
 import argparse
+import collections
+import multiprocessing
+from json_stream import json_iter_items, json_load_skip
+from pano_cache import pano_cache_load
+from stage_profile import profile_new, profile_merge, profile_frame, profile_report, prof_stage, prof_iter
+from pano_codec import default_codec
+from mask_source import mask_source, imdecode_data, imwrite_mask, take_deferred_writes, make_output_dir, is_deferred_path, is_existing_store, is_existing_zip, defer_file_writes, DeferredOutputs
+from async_io import PrefetchSource, read_ahead, AsyncWriter
+from conv_manifest import manifest_load, manifest_save, params_fingerprint, frame_fingerprint, frame_up_to_date
 
 def tqdm_none(l, desc='', total=None):
     return l
@@ -39,40 +46,298 @@ def check_set_cont(n):
 def intids_to_bgrids(masksegm):
     return check_set_cont(masksegm).view(np.uint8).reshape((masksegm.shape[0],masksegm.shape[1],4))[:,:,::-1][:,:,1:4]
 
-def panoptic2segm(json_path, outp_dir_sem=None, outp_dir_inst=None, label_png_dir=None, tqdm_vers=tqdm_nb):
+#returns index of each entry of ids within the sorted array keys; ids not contained in keys get index len(keys)
+def lookup_idx(ids, keys):
+    idx = np.searchsorted(keys, ids)
+    if len(keys) > 0:
+        idx[keys[np.minimum(idx, len(keys)-1)] != ids] = len(keys)
+    return idx
+
+#replace all ids found in the dict id_map by their mapped value; other ids are kept
+#out: optional preallocated result array (may be ids itself for inplace remapping)
+def remap_ids(ids, id_map, out=None):
+    keys = np.array(sorted(id_map.keys()), dtype=ids.dtype)
+    vals = np.array([id_map[k] for k in keys.tolist()], dtype=ids.dtype)
+    idx = lookup_idx(ids, keys)
+    hit = idx < len(keys)
+    if out is None:
+        out = ids.copy()
+    elif not out is ids:
+        np.copyto(out, ids)
+    out[hit] = vals[idx[hit]]
+    return out
+
+#calc per-segment lookup tables (sorted segment ids, semantic uint8 and instance uint16 values) from segments_info;
+#a trailing 0 entry is appended to both value tables for pixels not belonging to any segment
+#later entries overwrite earlier entries with the same id (identical to painting them one after another)
+#raises ValueError if a category id (> 255) or instance id (e.g. 74 * 1000 + 1 for thing category 74) does not fit
+#(instance ids are only checked with check_instances; otherwise the instance table is not meant to be used)
+def segments_luts(segments_info, is_thing, check_instances=True):
+    seg_vals, num_things = {}, 1
+    for s in segments_info:
+        category_id = s["category_id"]
+        if is_thing[category_id]:
+            seg_vals[s["id"]] = (category_id, category_id * 1000 + num_things)
+            num_things += 1
+        else:
+            seg_vals[s["id"]] = (category_id, category_id)
+    keys = sorted(seg_vals.keys())
+    vals = np.array([seg_vals[k] for k in keys]+[(0, 0)], dtype=np.int64).reshape((-1, 2))
+    max_inst = 65535 if check_instances else np.iinfo(np.int64).max
+    if vals.min() < 0 or vals[:, 0].max() > 255 or vals[:, 1].max() > max_inst:
+        raise ValueError("category/instance ids out of range of the semantic uint8/instance uint16 images: %s"%
+                         [(k, v.tolist()) for k, v in zip(keys, vals) if v[0] < 0 or v[0] > 255 or v[1] < 0 or v[1] > max_inst])
+    return np.array(keys, dtype=np.uint32), vals[:, 0].astype(np.uint8), vals[:, 1].astype(np.uint16)
+
+#create semantic (uint8) and instance (uint16) images from panoptic ids using a single lookup pass over all pixels
+def paint_segments(ids, segments_info, is_thing, check_instances=True):
+    keys, sem_lut, inst_lut = segments_luts(segments_info, is_thing, check_instances)
+    idx = lookup_idx(ids, keys)
+    return sem_lut[idx], inst_lut[idx]
+
+#area and tight bbox ([x, y, width, height] with width = xmax-xmin+1) of each segment id in keys (default: all ids found in ids)
+#computed in a few bincount passes over all pixels (no per-segment loops); ids missing in the mask get area 0 and bbox [0, 0, 0, 0]
+#returns sorted unique keys, area (n) and bbox (n x 4) as int64 arrays
+def segment_stats(ids, keys=None):
+    keys = np.unique(ids) if keys is None else np.array(sorted(set(keys)), dtype=ids.dtype)
+    num_bins, (h, w) = len(keys)+1, ids.shape
+    idx = lookup_idx(ids, keys)
+    area = np.bincount(idx.ravel(), minlength=num_bins)[:-1]
+    rows = np.bincount((idx+np.arange(h)[:, None]*num_bins).ravel(), minlength=h*num_bins).reshape((h, num_bins))[:, :-1] > 0
+    cols = np.bincount((idx+np.arange(w)[None, :]*num_bins).ravel(), minlength=w*num_bins).reshape((w, num_bins))[:, :-1] > 0
+    y0, y1 = rows.argmax(axis=0), h-1-rows[::-1].argmax(axis=0)
+    x0, x1 = cols.argmax(axis=0), w-1-cols[::-1].argmax(axis=0)
+    bbox = np.stack([x0, y0, x1-x0+1, y1-y0+1], axis=1).astype(np.int64)
+    bbox[area == 0] = 0
+    return keys, area.astype(np.int64), bbox
+
+#worker process state; set once per process by the pool initializer instead of sending it with every task
+_worker_ctx = {}
+def _init_worker(ctx):
+    _worker_ctx.clear()
+    _worker_ctx.update(ctx)
+def _call_worker(func, item):
+    return func(_worker_ctx, item)
+
+#applies func(ctx, item) to all items using a pool of worker processes (workers <= 1: run in current process)
+#yields (item, result) tuples in input order; at most max_pending tasks are queued to keep memory bounded
+#task: optional function selecting the part of each item which is sent to func (default: the item itself)
+def pool_imap(func, items, workers=1, ctx={}, max_pending=None, task=None):
+    task = task or (lambda item: item)
+    if workers <= 1:
+        _init_worker(ctx)
+        for item in items:
+            yield item, func(_worker_ctx, task(item))
+        return
+    max_pending = max_pending or workers * 4
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(ctx,)) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append((item, pool.apply_async(_call_worker, (func, task(item)))))
+            if len(pending) >= max_pending:
+                item0, res0 = pending.popleft()
+                yield item0, res0.get()
+        while len(pending) > 0:
+            item0, res0 = pending.popleft()
+            yield item0, res0.get()
+
+#output paths of write_segm
+def segm_out_paths(semantic_name, outp_dir_sem=None, outp_dir_inst=None):
+    ret = [outp_dir_sem+'/'+semantic_name] if outp_dir_sem else []
+    if outp_dir_inst:
+        ret.append(outp_dir_inst+'/'+semantic_name.replace("_labelIds.png", "_instanceIds.png"))
+    return ret
+
+#paint and write semantic (outp_dir_sem/semantic_name) and instance png (outp_dir_inst, *_instanceIds.png) of one frame
+def write_segm(ids, segments_info, is_thing, semantic_name, outp_dir_sem=None, outp_dir_inst=None, prof=None):
+    with prof_stage(prof, 'segment_painting'):
+        semantic, instances = paint_segments(ids, segments_info, is_thing, check_instances=bool(outp_dir_inst))
+    out_paths = segm_out_paths(semantic_name, outp_dir_sem, outp_dir_inst)
+    if outp_dir_sem:
+        imwrite_mask(out_paths[0], semantic, prof)
+    if outp_dir_inst:
+        imwrite_mask(out_paths[-1], instances, prof)
+
+#convert a single panoptic annotation into semantic/instance pngs (task: annotation, fingerprint of its last conversion)
+#returns (None on success or an error message, new fingerprint, True if skipped as outputs are up to date, frame profile or None,
+#         outputs to be written into zip archives/label stores by the main process)
+def annot2segm(ctx, task):
+    a, old_fp = task
+    prof = profile_new() if ctx.get('profile') else None
+    with prof_stage(prof, 'frame'):
+        ret = annot2segm_prof(ctx, a, old_fp, prof)
+    return ret+(prof, take_deferred_writes())
+
+def annot2segm_prof(ctx, a, old_fp, prof):
+    image_id = a["image_id"]
+    if not image_id in ctx['id2image']:
+        return "image_id not found in images", None, False
+    try:
+        fp = None
+        semantic_name = ctx['id2image'][image_id]["file_name"].replace(".jpg", "_labelIds.png")
+        if ctx['incremental']:
+            with prof_stage(prof, 'fs_read'):
+                data = ctx['mask_src'].read(a["file_name"])
+            with prof_stage(prof, 'fingerprint'):
+                fp = frame_fingerprint(data, ctx['params_fp'], [[s["id"], s["category_id"]] for s in a["segments_info"]], semantic_name)
+                up_to_date = frame_up_to_date(fp, old_fp, segm_out_paths(semantic_name, ctx['outp_dir_sem'], ctx['outp_dir_inst']))
+            if up_to_date:
+                return None, fp, True
+            with prof_stage(prof, 'png_decode'):
+                bgr_labels = imdecode_data(data)
+        else:
+            bgr_labels = ctx['mask_src'].imread(a["file_name"], prof)
+        if bgr_labels is None:
+            return "could not read mask", None, False
+        with prof_stage(prof, 'id_packing'):
+            ids = default_codec.decode(bgr_labels)
+        write_segm(ids, a["segments_info"], ctx['is_thing'], semantic_name, ctx['outp_dir_sem'], ctx['outp_dir_inst'], prof=prof)
+    except Exception as e:
+        return str(e), None, False
+    return None, fp, False
+
+#compare area and bbox of all segments_info entries of one annotation with the exact stats of its mask (task: annotation)
+#returns (None on success or an error message, list of (segment id, issue) tuples; segment id None: pixels without segment)
+def audit_annot(ctx, a):
+    try:
+        bgr_labels = ctx['mask_src'].imread(a["file_name"])
+        if bgr_labels is None:
+            return "could not read mask", []
+        ids = default_codec.decode(bgr_labels)
+        keys, area, bbox = segment_stats(ids, [s["id"] for s in a["segments_info"]])
+        stats = {k: (a0, b0) for k, a0, b0 in zip(keys.tolist(), area.tolist(), bbox.tolist())}
+        issues = []
+        for s in a["segments_info"]:
+            area0, bbox0 = stats[s["id"]]
+            if area0 == 0:
+                issues.append((s["id"], "not found in mask"))
+                continue
+            if s.get("area") != area0:
+                issues.append((s["id"], "area %s != %i (mask)"%(s.get("area"), area0)))
+            if s.get("bbox") != bbox0:
+                issues.append((s["id"], "bbox %s != %s (mask)"%(s.get("bbox"), bbox0)))
+        if area.sum() < ids.size:
+            unknown_ids = np.unique(ids[lookup_idx(ids, keys) == len(keys)])
+            unknown_ids = unknown_ids[unknown_ids != 0] #id 0: unlabeled
+            if len(unknown_ids) > 0:
+                issues.append((None, "mask ids without segments_info entry: %s"%unknown_ids.tolist()))
+    except Exception as e:
+        return str(e), []
+    return None, issues
+
+#load panoptic json meta data and an iterable of its annotations (see panoptic2segm for stream_json/use_cache)
+#seg_keys: segment keys needed from the cache; returns json without annotations, annotations, number of annotations (None if unknown)
+def panoptic_annotations(json_path, stream_json=False, use_cache=False, seg_keys=None, prof=None):
+    if use_cache:
+        with prof_stage(prof, 'cache_load'):
+            cache = pano_cache_load(json_path)
+        return cache.meta, prof_iter(prof, 'cache_annotation', cache.iter_annotations(seg_keys=seg_keys)), len(cache)
+    elif stream_json:
+        with prof_stage(prof, 'json_parse'):
+            pano0 = json_load_skip(json_path, ['annotations'])
+        return pano0, prof_iter(prof, 'json_parse', json_iter_items(json_path, 'annotations')), None
+    with prof_stage(prof, 'json_parse'):
+        pano0 = json.load(open(json_path))
+    return pano0, pano0["annotations"], len(pano0["annotations"])
+
+#check area/bbox of all segments of a panoptic json against its masks (see audit_annot)
+#returns list of (mask file_name, segment id, issue); frames failing to load are reported with segment id None
+def panoptic_audit(json_path, label_png_dir=None, tqdm_vers=tqdm_nb, workers=1, stream_json=False, use_cache=False):
+    if label_png_dir is None: label_png_dir = json_path[:json_path.rfind('.')]
+    pano0, annotations, num_annotations = panoptic_annotations(json_path, stream_json=stream_json, use_cache=use_cache, seg_keys=('id', 'area', 'bbox'))
+    ret = []
+    for a, (err, issues) in tqdm_vers(pool_imap(audit_annot, annotations, workers=workers, ctx={'mask_src': mask_source(label_png_dir)}), total=num_annotations):
+        if not err is None:
+            ret.append((a["file_name"], None, err))
+        ret += [(a["file_name"], i, issue) for i, issue in issues]
+    return ret
+
+# label_png_dir: directory, zip archive or folder within a zip archive (<archive>.zip/<folder>) of the panoptic masks
+#                (default: directory or zip archive with the same name as the json)
+# outp_dir_sem/outp_dir_inst: output directories, zip archives (*.zip) or label stores (*.lstore[/<folder>], see label_store.py)
+# workers: number of worker processes converting frames in parallel (<= 1: single process)
+# ret_failures: optional list which receives (mask file_name, error message) for each failed frame
+# stream_json: read annotations one by one instead of loading the whole json (bounded memory for very large files)
+# use_cache: read annotations from the binary sidecar cache of json_path (created if missing/outdated, see pano_cache.py)
+# incremental: keep a manifest of finished frames in the output directory; frames with unchanged mask content and
+#              segments_info are skipped on reruns (resumes aborted runs); ret_skipped receives their mask file_names
+# prof: optional profile (see stage_profile.py) which receives per-stage timings and the slowest frames
+# async_io: single process only (workers <= 1): masks of the next async_io frames are read/decoded by background threads
+#           and outputs of up to async_io frames are written in the background (see async_io.py); 0: synchronous I/O
+# append_store: add frames to existing label stores (<name>.lstore outputs); otherwise existing stores are not overwritten (ValueError)
+# append_zip: add frames to existing zip archives (<name>.zip outputs); otherwise existing archives are not overwritten (ValueError)
+def panoptic2segm(json_path, outp_dir_sem=None, outp_dir_inst=None, label_png_dir=None, tqdm_vers=tqdm_nb, workers=1, ret_failures=None, stream_json=False, use_cache=False, incremental=False, ret_skipped=None, prof=None, async_io=0, append_store=False, append_zip=False):
+    take_deferred_writes() #discard writes left over by other callers in this process
     #default: masks are in a directory with the same name as the panoptic json filename
     if label_png_dir is None: label_png_dir = json_path[:json_path.rfind('.')]
-    pano0 = json.load(open(json_path))
+    pano0, annotations, num_annotations = panoptic_annotations(json_path, stream_json=stream_json, use_cache=use_cache, seg_keys=('id', 'category_id'), prof=prof)
     id2image = {image["id"]: image for image in pano0["images"]}
     is_thing = {cat["id"]: cat["isthing"] for cat in pano0["categories"]}
-    if outp_dir_sem and not os.path.exists(outp_dir_sem): os.makedirs(outp_dir_sem)
-    if outp_dir_inst and not os.path.exists(outp_dir_inst): os.makedirs(outp_dir_inst)
-    cnt_success = 0
-    for a in tqdm_vers(pano0["annotations"]): 
-        image_id = a["image_id"]
-        if image_id in id2image: 
-            ids_path = label_png_dir+'/'+ a["file_name"]
-            bgr_labels = cv2.imread(ids_path)
-            ids = bgrids_to_intids(np.asarray(bgr_labels))
-            semantic = np.zeros_like(ids, dtype="uint8")
-            instances = np.zeros_like(ids, dtype="uint16")
-            num_things = 1
-            for s in a["segments_info"]: 
-                id0 = s["id"]
-                category_id = s["category_id"]
-                semantic[ids == id0] = category_id
-                if is_thing[category_id]: 
-                    instances[ids == id0] = category_id * 1000 + num_things
-                    num_things += 1
-                else: 
-                    instances[ids == id0] = category_id
-            if outp_dir_sem:
-                semantic_name = id2image[image_id]["file_name"].replace(".jpg", "_labelIds.png")
-                cv2.imwrite(outp_dir_sem+'/'+semantic_name, semantic)
-            if outp_dir_inst:
-                instance_name = semantic_name.replace("_labelIds.png", "_instanceIds.png")
-                cv2.imwrite(outp_dir_inst+'/'+instance_name, instances)
-            cnt_success += 1
+    if not append_store and (is_existing_store(outp_dir_sem) or is_existing_store(outp_dir_inst)):
+        raise ValueError("Output label store exists already (use append_store to add frames or remove it)")
+    if not append_zip and (is_existing_zip(outp_dir_sem) or is_existing_zip(outp_dir_inst)):
+        raise ValueError("Output zip archive exists already (use append_zip to add frames or remove it)")
+    if outp_dir_sem: make_output_dir(outp_dir_sem)
+    if outp_dir_inst: make_output_dir(outp_dir_inst)
+    if incremental and (is_deferred_path(outp_dir_sem) or is_deferred_path(outp_dir_inst)):
+        print("Warning: incremental conversion is not supported for zip/label store outputs; converting all frames.")
+        incremental = False
+    ctx = {'id2image': id2image, 'is_thing': is_thing, 'mask_src': mask_source(label_png_dir),
+           'outp_dir_sem': outp_dir_sem, 'outp_dir_inst': outp_dir_inst, 'incremental': incremental, 'profile': not prof is None,
+           'params_fp': params_fingerprint('pano2sem', is_thing, outp_dir_sem, outp_dir_inst)}
+    manifest_path = (outp_dir_sem or outp_dir_inst)+'/.pano2sem_manifest.json'
+    manifest = manifest_load(manifest_path) if incremental else {'frames': {}}
+    frames = manifest['frames']
+    use_async = async_io > 0 and workers <= 1
+    if use_async:
+        ctx['mask_src'] = PrefetchSource(ctx['mask_src'])
+        annotations = read_ahead(annotations, ctx['mask_src'], lambda a: (a["file_name"], not incremental), depth=async_io)
+        defer_file_writes(True)
+    cnt_success, deferred_outputs = 0, DeferredOutputs(writer=AsyncWriter(async_io) if use_async else None, append_stores=append_store, append_zips=append_zip)
+    pending_fps = {} #fingerprints of successful frames whose outputs are not yet confirmed as written
+    #outputs of successful frames which could not be written in the background
+    def write_failed(errors):
+        errors = [(file_name, err) for file_name, err in errors if not file_name is None]
+        for file_name, err in errors:
+            pending_fps.pop(file_name, None)
+            frames.pop(file_name, None)
+            if not ret_failures is None:
+                ret_failures.append((file_name, err))
+        return len(errors)
+    #record frames in the manifest only once their outputs are written
+    def write_done(file_names):
+        for file_name in file_names:
+            if file_name in pending_fps:
+                frames[file_name] = pending_fps.pop(file_name)
+    try:
+        for a, (err, fp, skipped, frame_prof, deferred_writes) in tqdm_vers(pool_imap(annot2segm, annotations, workers=workers, ctx=ctx, task=lambda a: (a, frames.get(a["file_name"]))), total=num_annotations):
+            if not frame_prof is None:
+                profile_merge(prof, frame_prof)
+                profile_frame(prof, a["file_name"], frame_prof['stages']['frame'][1])
+            deferred_outputs.write(deferred_writes, prof, tag=a["file_name"] if err is None else None)
+            if err is None:
+                cnt_success += 1
+                frames.pop(a["file_name"], None)
+                pending_fps[a["file_name"]] = fp
+                if skipped and not ret_skipped is None:
+                    ret_skipped.append(a["file_name"])
+            else:
+                frames.pop(a["file_name"], None)
+                if not ret_failures is None:
+                    ret_failures.append((a["file_name"], err))
+            cnt_success -= write_failed(deferred_outputs.take_errors())
+            write_done(deferred_outputs.take_done())
+            if incremental:
+                manifest_save(manifest, manifest_path, min_interval=10)
+    finally:
+        deferred_outputs.close()
+        cnt_success -= write_failed(deferred_outputs.take_errors())
+        write_done(deferred_outputs.take_done())
+        if use_async:
+            ctx['mask_src'].close()
+            defer_file_writes(False)
+        if incremental:
+            manifest_save(manifest, manifest_path)
     return cnt_success
     
 def pano2sem_main(argv=sys.argv[1:]):
@@ -80,22 +345,59 @@ def pano2sem_main(argv=sys.argv[1:]):
     parser.add_argument('--json_path', type=str, default="panoptic.json",
                         help="Path to panoptic COCO json")
     parser.add_argument('--outp_dir_sem', type=str, default=None,
-                        help="Target directory for semantic uint8 pngs")
+                        help="Target directory (or zip archive *.zip or label store *.lstore[/folder]) for semantic uint8 pngs")
     parser.add_argument('--outp_dir_inst', type=str, default=None,
-                        help="Target directory for instance uint16 pngs")
+                        help="Target directory (or zip archive *.zip or label store *.lstore[/folder]) for instance uint16 pngs")
     parser.add_argument('--label_png_dir', type=str, default=None,
-                        help="Specify directory of panoptic COCO png BGR masks (default: use json_path as hint)")
+                        help="Specify directory or zip archive (optionally with folder: archive.zip/folder) of panoptic COCO png BGR masks (default: use json_path as hint)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes for parallel conversion")
+    parser.add_argument('--async_io', type=int, default=4,
+                        help="Without --workers: read masks of this many frames ahead and write outputs in the background (0: synchronous I/O)")
+    parser.add_argument('--append_store', action='store_true', help="Add frames to existing label stores (<name>.lstore outputs) instead of refusing to overwrite them")
+    parser.add_argument('--append_zip', action='store_true', help="Add frames to existing zip archives (<name>.zip outputs) instead of refusing to overwrite them")
+    parser.add_argument('--stream_json', action='store_true', help="Read annotations one by one (bounded memory for very large json files)")
+    parser.add_argument('--use_cache', action='store_true', help="Use/create a binary sidecar cache (<json_path>.cache.npz) for faster loading")
+    parser.add_argument('--incremental', action='store_true', help="Keep a manifest of finished frames; reruns skip frames whose outputs are up to date")
+    parser.add_argument('--profile', type=str, nargs='?', const='pano2sem_profile.json', default=None,
+                        help="Time all processing stages; writes a json report (default: pano2sem_profile.json) and prints a summary")
+    parser.add_argument('--audit', type=str, nargs='?', const='pano2sem_audit.json', default=None,
+                        help="Only check area/bbox of all segments against the masks; writes a json report of all issues (default: pano2sem_audit.json)")
     parser.add_argument('--silent', action='store_true', help="Suppress all outputs")
     parser.add_argument('--verbose', action='store_true', help="Print extra information")
     args = parser.parse_args(argv)
+    tqdm_vers = tqdm_none if args.silent else tqdm_con
+    if args.audit:
+        issues = panoptic_audit(json_path=args.json_path, label_png_dir=args.label_png_dir, tqdm_vers=tqdm_vers, workers=args.workers, stream_json=args.stream_json, use_cache=args.use_cache)
+        json.dump(issues, open(args.audit, 'w'), indent=1)
+        if not args.silent:
+            print("Finished auditing panoptic COCO GT with %i issues in %i frames."%(len(issues), len(set(i[0] for i in issues))))
+            if args.verbose and len(issues) > 0:
+                print("Found these issues: ", issues)
+        return 0
     if not args.outp_dir_sem and not args.outp_dir_inst:
         if not args.silent:
             print("Error: no output operation selected.")
         return -1
-    tqdm_vers = tqdm_none if args.silent else tqdm_con
-    cnt_success = panoptic2segm(json_path=args.json_path, outp_dir_sem=args.outp_dir_sem, outp_dir_inst=args.outp_dir_inst, label_png_dir=args.label_png_dir, tqdm_vers=tqdm_vers)
+    if not args.append_store and (is_existing_store(args.outp_dir_sem) or is_existing_store(args.outp_dir_inst)):
+        if not args.silent:
+            print("Error: output label store exists already; use --append_store to add frames to it or remove it.")
+        return -1
+    if not args.append_zip and (is_existing_zip(args.outp_dir_sem) or is_existing_zip(args.outp_dir_inst)):
+        if not args.silent:
+            print("Error: output zip archive exists already; use --append_zip to add frames to it or remove it.")
+        return -1
+    failures, skipped = [], []
+    prof = profile_new() if args.profile else None
+    cnt_success = panoptic2segm(json_path=args.json_path, outp_dir_sem=args.outp_dir_sem, outp_dir_inst=args.outp_dir_inst, label_png_dir=args.label_png_dir, tqdm_vers=tqdm_vers, workers=args.workers, ret_failures=failures, stream_json=args.stream_json, use_cache=args.use_cache, incremental=args.incremental, ret_skipped=skipped, prof=prof, async_io=args.async_io, append_store=args.append_store, append_zip=args.append_zip)
     if not args.silent:
-        print("Finished converting panoptic COCO GT with %i successes."%(success_cnt))
+        print("Finished converting panoptic COCO GT with %i successes (%i up to date) and %i failures."%(cnt_success, len(skipped), len(failures)))
+        if args.verbose and len(failures) > 0:
+            print("Generated these failures: ", failures)
+    if not prof is None:
+        summary = profile_report(prof, args.profile)
+        if not args.silent:
+            print(summary)
 
 if __name__ == "__main__":
     sys.exit(pano2sem_main())
\ No newline at end of file
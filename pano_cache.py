@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# binary columnar sidecar cache for panoptic COCO json files (<json_path>.cache.npz)
+# segment ids, categories, iscrowd, area, bbox and per-image offsets are stored as numpy arrays which load
+# in a fraction of the time needed to parse the json; the cache is rebuilt whenever mtime/size of the json change
+# see https://github.com/ozendelait/wilddash_scripts
+#
+# example:
+# cache = pano_cache_load('panoptic.json')
+# a = cache.annotation(cache.find('frame_0001'))
+#
+# Use this tool on your own risk!
+# Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
+# All rights reserved.
+#******************************************************************************
+
+import os
+import json
+import numpy as np
+from json_stream import json_iter_events
+
+pano_cache_version = 1
+seg_int_cols = ['id', 'category_id', 'iscrowd', 'area']
+
+def pano_cache_path(json_path):
+    return json_path+'.cache.npz'
+
+def json_stat(json_path):
+    st = os.stat(json_path)
+    return np.array([pano_cache_version, st.st_mtime_ns, st.st_size], dtype=np.int64)
+
+# cached annotations are reconstructed losslessly (key order, types and non-standard entries are kept):
+# values which do not fit the columns (e.g. float area, additional keys) are stored in a json encoded extras dict
+class PanopticCache:
+    def __init__(self, arrays):
+        self.meta = json.loads(str(arrays['meta']))
+        self.key_patterns = json.loads(str(arrays['key_patterns']))
+        extras = json.loads(str(arrays['extras']))
+        self.annot_extras = {int(k): v for k, v in extras['annot'].items()}
+        self.seg_extras = {int(k): v for k, v in extras['seg'].items()}
+        self.annot_keys, self.annot_image_id, self.annot_file_name = arrays['annot_keys'], arrays['annot_image_id'], arrays['annot_file_name']
+        self.seg_offsets, self.seg_keys, self.seg_bbox = arrays['seg_offsets'], arrays['seg_keys'], arrays['seg_bbox']
+        self.seg_cols = {k: arrays['seg_'+k] for k in seg_int_cols}
+        self.image_id2idx = None
+
+    def __len__(self):
+        return len(self.annot_keys)
+
+    # index of annotation for image_id (None if not found)
+    def find(self, image_id):
+        if self.image_id2idx is None:
+            self.image_id2idx = {i: idx for idx, i in enumerate(self.annot_image_id.tolist())}
+        return self.image_id2idx.get(json.dumps(image_id))
+
+    # segment ids and category ids of one annotation as numpy arrays
+    def segment_arrays(self, idx):
+        o0, o1 = self.seg_offsets[idx], self.seg_offsets[idx+1]
+        return self.seg_cols['id'][o0:o1], self.seg_cols['category_id'][o0:o1]
+
+    # reconstruct annotation dict idx; seg_keys: optional subset of segment keys (faster if only ids/categories are needed)
+    def annotation(self, idx, seg_keys=None):
+        o0, o1 = int(self.seg_offsets[idx]), int(self.seg_offsets[idx+1])
+        cols = {k: c[o0:o1].tolist() for k, c in self.seg_cols.items() if seg_keys is None or k in seg_keys}
+        if seg_keys is None or 'bbox' in seg_keys:
+            cols['bbox'] = self.seg_bbox[o0:o1].tolist()
+        patterns = self.seg_keys[o0:o1].tolist()
+        segments_info = []
+        for i in range(o1-o0):
+            extras = self.seg_extras.get(o0+i, {})
+            segments_info.append({k: extras[k] if k in extras else cols[k][i] for k in self.key_patterns[patterns[i]] if seg_keys is None or k in seg_keys})
+        extras = self.annot_extras.get(idx, {})
+        cols = {'image_id': json.loads(str(self.annot_image_id[idx])), 'file_name': str(self.annot_file_name[idx]), 'segments_info': segments_info}
+        return {k: extras[k] if k in extras else cols[k] for k in self.key_patterns[int(self.annot_keys[idx])]}
+
+    def iter_annotations(self, seg_keys=None):
+        for idx in range(len(self)):
+            yield self.annotation(idx, seg_keys=seg_keys)
+
+# parse json_path (streaming) and store the columnar cache next to it (kept in memory only if it cannot be saved)
+def pano_cache_build(json_path):
+    meta, key_patterns, annot_extras, seg_extras = {}, {}, {}, {}
+    annot_keys, annot_image_id, annot_file_name, seg_offsets = [], [], [], [0]
+    seg_keys, seg_bbox, seg_cols = [], [], {k: [] for k in seg_int_cols}
+    src_stat = json_stat(json_path)
+    for ev, key, val in json_iter_events(json_path):
+        if key != 'annotations':
+            if ev == 'array':
+                meta[key] = []
+            elif ev == 'item':
+                meta[key].append(val)
+            else:
+                meta[key] = val
+            continue
+        meta[key] = None
+        if ev != 'item':
+            continue
+        extras, idx = {}, len(annot_keys)
+        annot_keys.append(key_patterns.setdefault(tuple(val.keys()), len(key_patterns)))
+        annot_image_id.append(json.dumps(val.get('image_id')))
+        file_name = val.get('file_name', '')
+        annot_file_name.append(file_name if type(file_name) is str else '')
+        if not type(file_name) is str:
+            extras['file_name'] = file_name
+        segments_info = val.get('segments_info', [])
+        if not type(segments_info) is list:
+            extras['segments_info'], segments_info = segments_info, []
+        for k in val.keys():
+            if not k in ['image_id', 'file_name', 'segments_info']:
+                extras[k] = val[k]
+        if len(extras) > 0:
+            annot_extras[idx] = extras
+        for s in segments_info:
+            extras = {}
+            seg_keys.append(key_patterns.setdefault(tuple(s.keys()), len(key_patterns)))
+            for k in seg_int_cols:
+                v = s.get(k, 0)
+                seg_cols[k].append(v if type(v) is int else 0)
+            bbox = s.get('bbox', [0, 0, 0, 0])
+            is_int_bbox = type(bbox) is list and len(bbox) == 4 and all(type(v) is int for v in bbox)
+            seg_bbox.append(bbox if is_int_bbox else [0, 0, 0, 0])
+            for k, v in s.items():
+                if not k in seg_int_cols+['bbox'] or (k == 'bbox' and not is_int_bbox) or (k != 'bbox' and not type(v) is int):
+                    extras[k] = v
+            if len(extras) > 0:
+                seg_extras[len(seg_keys)-1] = extras
+        seg_offsets.append(len(seg_keys))
+    arrays = {'src_stat': src_stat, 'meta': np.array(json.dumps(meta)),
+              'key_patterns': np.array(json.dumps([list(k) for k in key_patterns.keys()])),
+              'extras': np.array(json.dumps({'annot': annot_extras, 'seg': seg_extras})),
+              'annot_keys': np.array(annot_keys, dtype=np.int32), 'annot_image_id': np.array(annot_image_id, dtype=np.str_),
+              'annot_file_name': np.array(annot_file_name, dtype=np.str_), 'seg_offsets': np.array(seg_offsets, dtype=np.int64),
+              'seg_keys': np.array(seg_keys, dtype=np.int32), 'seg_bbox': np.array(seg_bbox, dtype=np.int64).reshape((-1, 4))}
+    for k in seg_int_cols:
+        arrays['seg_'+k] = np.array(seg_cols[k], dtype=np.int64)
+    tmp_path = pano_cache_path(json_path)+'.tmp'
+    try:
+        with open(tmp_path, 'wb') as ofile:
+            np.savez(ofile, **arrays)
+        os.replace(tmp_path, pano_cache_path(json_path))
+    except OSError as e:
+        print("Warning: could not save cache %s (%s); using it in memory only."%(pano_cache_path(json_path), str(e)))
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+    return PanopticCache(arrays)
+
+# load the cache of json_path; (re)builds it if it is missing or outdated (build=False: returns None instead)
+def pano_cache_load(json_path, build=True):
+    cache_path = pano_cache_path(json_path)
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as arrays:
+                if np.array_equal(arrays['src_stat'], json_stat(json_path)):
+                    return PanopticCache({k: arrays[k] for k in arrays.files})
+        except Exception:
+            pass #broken cache file, rebuild
+    return pano_cache_build(json_path) if build else None
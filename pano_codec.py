@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# conversion between panoptic COCO BGR png masks and uint32 segment ids (id = R + 256*G + 65536*B) using reused buffers
+# decoding/encoding is a single cv2.cvtColor pass into a preallocated RGBA/BGR buffer which is viewed as uint32 ids
+# (no per-frame full-resolution temporaries); returned arrays are views into the buffer pool of the codec and are
+# overwritten by the next call using the same buffer name -> copy them if they are needed longer
+# a codec is not thread-safe; use one codec per thread/process (see default_codec)
+#
+# example:
+# codec = MaskCodec()
+# for path, ids in codec.read_batch(paths):
+#     codec.write(path.replace('src', 'trg'), ids)
+#
+# see https://github.com/ozendelait/wilddash_scripts
+#
+# Use this tool on your own risk!
+# Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
+# All rights reserved.
+#******************************************************************************
+
+import sys
+import cv2
+import numpy as np
+
+#the uint32 view of an RGBA buffer is R + 256*G + 65536*B + 2**24*A only on little endian machines
+is_little_endian = sys.byteorder == 'little'
+
+class MaskCodec:
+    def __init__(self):
+        self.buffers = {}
+
+    # buffer name of given shape/dtype from the pool (reallocated only if shape or dtype change)
+    def buffer(self, name, shape, dtype):
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = self.buffers[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    # BGR mask (h x w x 3 uint8) -> uint32 ids (h x w, view into buffer name)
+    def decode(self, bgr, name='ids'):
+        h, w = bgr.shape[:2]
+        rgba = self.buffer(name, (h, w, 4), np.uint8)
+        ids = rgba.view(np.uint32)[:, :, 0]
+        if is_little_endian:
+            cv2.cvtColor(bgr, cv2.COLOR_BGR2RGBA, dst=rgba)
+            np.bitwise_and(ids, 0xFFFFFF, out=ids) #clear alpha channel
+        else:
+            tmp = self.buffer(name+'_tmp', (h, w), np.uint32)
+            np.left_shift(bgr[:, :, 0], 16, out=ids, dtype=np.uint32)
+            np.left_shift(bgr[:, :, 1], 8, out=tmp, dtype=np.uint32)
+            np.bitwise_or(ids, tmp, out=ids)
+            np.bitwise_or(ids, bgr[:, :, 2], out=ids, casting='unsafe')
+        return ids
+
+    # uint32 ids (h x w) -> contiguous BGR mask (h x w x 3 uint8, view into buffer name)
+    def encode(self, ids, name='bgr'):
+        h, w = ids.shape
+        bgr = self.buffer(name, (h, w, 3), np.uint8)
+        if ids.dtype != np.uint32:
+            ids = ids.astype(np.uint32)
+        if is_little_endian:
+            cv2.cvtColor(np.ascontiguousarray(ids).view(np.uint8).reshape((h, w, 4)), cv2.COLOR_RGBA2BGR, dst=bgr)
+        else:
+            np.right_shift(ids, 16, out=bgr[:, :, 0], casting='unsafe')
+            np.right_shift(ids, 8, out=bgr[:, :, 1], casting='unsafe')
+            np.copyto(bgr[:, :, 2], ids, casting='unsafe')
+        return bgr
+
+    # png file content -> ids (None if data can not be decoded)
+    def decode_png(self, data, name='ids'):
+        bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return None if bgr is None else self.decode(bgr, name=name)
+
+    # ids -> png (or other format given by ext) file content
+    def encode_png(self, ids, ext='.png', name='bgr'):
+        ok, data = cv2.imencode(ext, self.encode(ids, name=name))
+        return data.tobytes() if ok else None
+
+    # read mask file -> ids (None if the file can not be read)
+    def read(self, path, name='ids'):
+        bgr = cv2.imread(path)
+        return None if bgr is None else self.decode(bgr, name=name)
+
+    def write(self, path, ids, name='bgr'):
+        return cv2.imwrite(path, self.encode(ids, name=name))
+
+    # batch api: yields (path, ids or None) for all paths; all frames share the same buffer
+    def read_batch(self, paths, name='ids'):
+        for path in paths:
+            yield path, self.read(path, name=name)
+
+    # batch api: yields ids (or None) for each png file content in datas; all frames share the same buffer
+    def decode_batch(self, datas, name='ids'):
+        for data in datas:
+            yield self.decode_png(data, name=name)
+
+    # batch api: writes all (path, ids) items; returns list of paths which could not be written
+    def write_batch(self, items, name='bgr'):
+        return [path for path, ids in items if not self.write(path, ids, name=name)]
+
+#codec of the current process (used by pano2sem/remap_coco in the main process and in each worker process)
+default_codec = MaskCodec()
@@ -13,46 +13,43 @@
 import os
 import sys
 import argparse
-import shutil
 import json
-import cv2
-from pano2sem import bgrids_to_intids, intids_to_bgrids, tqdm_none, tqdm_nb, tqdm_con
+import contextlib
+from json_stream import json_iter_items, json_load_skip, JsonStreamWriter
+from pano_cache import pano_cache_load
+from conv_manifest import manifest_load, manifest_save, params_fingerprint, frame_fingerprint, frame_up_to_date
+from stage_profile import profile_new, profile_merge, profile_frame, profile_report, prof_stage, prof_iter
+from pano_codec import default_codec
+from mask_source import mask_source, imdecode_data, take_deferred_writes, make_output_dir, write_pano_ids, is_deferred_path, is_existing_store, is_existing_zip, defer_file_writes, DeferredOutputs
+from async_io import PrefetchSource, read_ahead, AsyncWriter
+from pano2sem import remap_ids, segment_stats, write_segm, segm_out_paths, pool_imap, tqdm_none, tqdm_nb, tqdm_con
 
 def to_abspath(p):
     return os.path.abspath(os.path.expanduser(os.path.expandvars(p)))
 
-# Remap single annotation entry from COCO panoptic format json inplace
+# Remap segments_info of a single annotation entry from COCO panoptic format json inplace
 # combine labels with optinal correction for iscrowd flags 
 # src_is_thing/trg_is_thing: 
 #     trgid in trg_is_thing:0 -> trg is a stuff label; combine potentially multiple category labels into one
 #     trgid in trg_is_thing:1 and srcid in src_is_thing:0 -> trg is a thing and src was stuff label (-> set s['iscrowd'] to 1)
-# supply src_dir and trg_dir to allow joining of the same trg stuff labels by loading/saving masks
-def remap_annotation(annot, src_to_trg, src_is_thing={}, trg_is_thing={}, src_dir=None, trg_dir=None, void_id=-1):
-    join_annots = {}
-    ret_annot, existing_ids = [], set()
-    do_calc_masks = not src_dir is None and not trg_dir is None
+# join_stuff: join segments of the same trg stuff label; the returned dict maps old segment ids to the joined segment id
+#             (an empty dict means the mask can be copied unchanged); area/bbox of joined segments are estimated from the
+#             old segments (sum/union) until replaced by exact values from the mask (see joined_segment_stats)
+def remap_annotation_segms(annot, src_to_trg, src_is_thing={}, trg_is_thing={}, join_stuff=False, void_id=-1):
+    join_annots, joins = {}, {}
+    ret_annot = []
     for s in annot['segments_info']:
         trg_cat = int(src_to_trg.get(s['category_id'],void_id))
         src_wasathing = src_is_thing.get(s['category_id'],-1)
         trg_isathing = trg_is_thing.get(trg_cat,-1)
         s['category_id'] = trg_cat
-        if do_calc_masks and trg_isathing == 0:
+        if join_stuff and trg_isathing == 0:
             join_annots.setdefault(trg_cat,[]).append(s)
             continue
         if src_wasathing == 0 and trg_isathing == 1:
             s['iscrowd'] = 1 #set iscrowd to indicated potential multitude of instances
-        existing_ids.add(s['id'])
         ret_annot.append(s)
-    msk, maxint, max_num_join = None, 2**31, 0
-    if do_calc_masks:
-        max_num_join = max([len(s) for s in join_annots.values()])
-    if do_calc_masks:
-        if src_dir == trg_dir:
-            print("Error: src_dir == trg_dir, skipping mask generation!")
-        elif max_num_join > 1:
-            msk = bgrids_to_intids(cv2.imread(src_dir+annot['file_name']))
-        else:
-            shutil.copy2(src_dir+annot['file_name'], trg_dir)
+    maxint = 2**31
     for trg_id, segms in join_annots.items():
         if len(segms) == 1:
             ret_annot.append(segms[0])
@@ -61,8 +58,7 @@ def remap_annotation(annot, src_to_trg, src_is_thing={}, trg_is_thing={}, src_di
         joined_segm = {'id':fix_mask_id,'category_id':trg_id,'iscrowd':0,'area':0}
         x0, y0, x1, y1 = maxint, maxint, -maxint, -maxint
         for s in segms:
-            if not msk is None:
-                msk[msk == s['id']] = fix_mask_id
+            joins[s['id']] = fix_mask_id
             joined_segm['area'] += s['area']
             x0, y0, x1, y1 = min(x0, s['bbox'][0]), \
                              min(y0, s['bbox'][1]), \
@@ -70,9 +66,136 @@ def remap_annotation(annot, src_to_trg, src_is_thing={}, trg_is_thing={}, src_di
                              max(y1, s['bbox'][1]+s['bbox'][3])
         joined_segm['bbox'] = [x0, y0, x1-x0, y1-y0]
         ret_annot.append(joined_segm)
-        if not msk is None:
-            cv2.imwrite(trg_dir+annot['file_name'], intids_to_bgrids(msk))
     annot['segments_info'] =  ret_annot
+    return annot, joins
+
+#exact area and tight bbox of all joined segments (joins: see remap_annotation_segms) from the source mask ids
+#(one vectorized pass, see segment_stats); returns list of [joined segment id, area, bbox]
+def joined_segment_stats(ids, joins):
+    keys, area, bbox = segment_stats(ids, joins.keys())
+    joined = {}
+    for old_id, area0, bbox0 in zip(keys.tolist(), area.tolist(), bbox.tolist()):
+        stats = joined.setdefault(joins[old_id], [0, None])
+        if area0 == 0:
+            continue
+        stats[0] += area0
+        x0, y0, x1, y1 = bbox0[0], bbox0[1], bbox0[0]+bbox0[2], bbox0[1]+bbox0[3]
+        if not stats[1] is None:
+            x0, y0, x1, y1 = min(x0, stats[1][0]), min(y0, stats[1][1]), max(x1, stats[1][2]), max(y1, stats[1][3])
+        stats[1] = [x0, y0, x1, y1]
+    return [[i, area0, [0, 0, 0, 0] if c is None else [c[0], c[1], c[2]-c[0], c[3]-c[1]]] for i, (area0, c) in sorted(joined.items())]
+
+#set area/bbox of joined segments in segments_info of a remapped annotation (joined_stats: see joined_segment_stats)
+def apply_joined_stats(annot, joined_stats):
+    stats = {i: (area0, bbox0) for i, area0, bbox0 in joined_stats}
+    for s in annot['segments_info']:
+        if s['id'] in stats:
+            s['area'], s['bbox'] = stats[s['id']]
+
+# Copy mask file_name from src_dir to trg_dir; segment ids found in joins are replaced in a single lookup table pass
+# src_dir may be a zip archive, trg_dir a zip archive or label store (see mask_source.py)
+# returns the exact stats of the joined segments (see joined_segment_stats; empty if the mask was copied)
+def remap_mask(file_name, joins, src_dir, trg_dir, prof=None):
+    if src_dir == trg_dir:
+        print("Error: src_dir == trg_dir, skipping mask generation!")
+    elif len(joins) > 0:
+        msk = mask_source(src_dir).imread(file_name, prof)
+        if msk is None:
+            raise IOError("could not read mask "+src_dir+file_name)
+        with prof_stage(prof, 'id_packing'):
+            ids = default_codec.decode(msk)
+        with prof_stage(prof, 'segment_stats'):
+            joined_stats = joined_segment_stats(ids, joins)
+        with prof_stage(prof, 'id_remap'):
+            ids = remap_ids(ids, joins, out=ids)
+        write_pano_ids(trg_dir+file_name, ids, prof)
+        return joined_stats
+    else:
+        mask_source(src_dir).copy_to(file_name, trg_dir+file_name, prof)
+    return []
+
+#output paths of remap_mask_worker for one job
+def remap_out_paths(ctx, file_name, trg_jobs):
+    ret = []
+    for trg, (joins, segments_info, semantic_name) in zip(ctx['targets'], trg_jobs):
+        if not trg['trg_dir'] is None and trg['trg_dir'] != ctx['src_dir']:
+            ret.append(trg['trg_dir']+file_name)
+        if not semantic_name is None:
+            ret += segm_out_paths(semantic_name, trg['outp_dir_sem'], trg['outp_dir_inst'])
+    return ret
+
+#pool worker remapping one mask for all targets (task: job, fingerprint of its last conversion)
+#job: file_name, list of (joins, segments_info, semantic_name) per ctx['targets']
+#the mask is decoded at most once; semantic/instance pngs are created directly from the remapped ids (semantic_name None: skip)
+#returns (None on success or an error message, new fingerprint, True if skipped as outputs are up to date,
+#         exact stats of joined segments per target (see joined_segment_stats; None if not computed), frame profile or None,
+#         outputs to be written into zip archives/label stores by the main process)
+def remap_mask_worker(ctx, task):
+    (file_name, trg_jobs), old_fp = task
+    prof = profile_new() if ctx.get('profile') else None
+    with prof_stage(prof, 'frame'):
+        ret = remap_mask_worker_prof(ctx, file_name, trg_jobs, old_fp, prof)
+    return ret+(prof, take_deferred_writes())
+
+def remap_mask_worker_prof(ctx, file_name, trg_jobs, old_fp, prof):
+    ids, data, fp = None, None, None
+    joined_stats = [[] for _ in trg_jobs]
+    try:
+        if ctx['incremental']:
+            with prof_stage(prof, 'fs_read'):
+                data = ctx['mask_src'].read(file_name)
+            with prof_stage(prof, 'fingerprint'):
+                fp = frame_fingerprint(data, ctx['params_fp'], trg_jobs)
+                up_to_date = frame_up_to_date(fp, old_fp, remap_out_paths(ctx, file_name, trg_jobs))
+            if up_to_date:
+                return None, fp, True, None
+        for k, (trg, (joins, segments_info, semantic_name)) in enumerate(zip(ctx['targets'], trg_jobs)):
+            do_segm = not semantic_name is None and (trg['outp_dir_sem'] or trg['outp_dir_inst'])
+            if trg['trg_dir'] == ctx['src_dir']:
+                print("Error: src_dir == trg_dir, skipping mask generation!")
+                continue
+            if not do_segm and len(joins) == 0:
+                if not trg['trg_dir'] is None:
+                    ctx['mask_src'].copy_to(file_name, trg['trg_dir']+file_name, prof)
+                continue
+            if ids is None:
+                if data is None:
+                    msk = ctx['mask_src'].imread(file_name, prof)
+                else:
+                    with prof_stage(prof, 'png_decode'):
+                        msk = imdecode_data(data)
+                if msk is None:
+                    return "could not read mask "+ctx['src_dir']+file_name, None, False, None
+                with prof_stage(prof, 'id_packing'):
+                    ids = default_codec.decode(msk)
+            if len(joins) > 0:
+                with prof_stage(prof, 'segment_stats'):
+                    joined_stats[k] = joined_segment_stats(ids, joins)
+            with prof_stage(prof, 'id_remap'):
+                trg_ids = remap_ids(ids, joins, out=default_codec.buffer('trg_ids', ids.shape, ids.dtype)) if len(joins) > 0 else ids
+            if not trg['trg_dir'] is None:
+                if len(joins) > 0:
+                    write_pano_ids(trg['trg_dir']+file_name, trg_ids, prof)
+                else:
+                    ctx['mask_src'].copy_to(file_name, trg['trg_dir']+file_name, prof)
+            if do_segm:
+                write_segm(trg_ids, segments_info, trg['is_thing'], semantic_name, trg['outp_dir_sem'], trg['outp_dir_inst'], prof=prof)
+    except Exception as e:
+        return str(e), None, False, None
+    return None, fp, False, joined_stats
+
+# Remap single annotation entry from COCO panoptic format json inplace (see remap_annotation_segms)
+# supply src_dir and trg_dir to allow joining of the same trg stuff labels by loading/saving masks
+# deferred_outputs: receives the writes if trg_dir is a zip archive/label store (mask_source.DeferredOutputs, closed by the caller)
+def remap_annotation(annot, src_to_trg, src_is_thing={}, trg_is_thing={}, src_dir=None, trg_dir=None, void_id=-1, deferred_outputs=None):
+    do_calc_masks = not src_dir is None and not trg_dir is None
+    if do_calc_masks and is_deferred_path(trg_dir) and deferred_outputs is None:
+        raise ValueError("trg_dir %s is a zip archive/label store: deferred_outputs (see mask_source.DeferredOutputs) is needed"%trg_dir)
+    annot, joins = remap_annotation_segms(annot, src_to_trg, src_is_thing=src_is_thing, trg_is_thing=trg_is_thing, join_stuff=do_calc_masks, void_id=void_id)
+    if do_calc_masks:
+        apply_joined_stats(annot, remap_mask(annot['file_name'], joins, src_dir, trg_dir))
+        if not deferred_outputs is None:
+            deferred_outputs.write(take_deferred_writes())
     return annot
         
 #calculate src->trg dataset transformations based on meta data (e.g. supplied by wd2_unified_label_policy.json)
@@ -107,6 +230,15 @@ def remapings_from_json(meta0, trg_dataset, src_dataset='wd2', src_fallback_name
     trgcats = [trgcats[k] for k in sorted(trgcats.keys())]
     return src_to_trg, src_is_thing, trg_is_thing, trgcats
 
+#output path for one of multiple target datasets: replaces {trg_dataset} or appends _<trg_dataset> to the path (before its extension)
+def trg_dataset_path(p, trg_dataset, is_multi):
+    if p is None or not is_multi:
+        return p
+    if '{trg_dataset}' in p:
+        return p.replace('{trg_dataset}', trg_dataset)
+    root, ext = os.path.splitext(p.rstrip('/'))
+    return root+'_'+trg_dataset+ext
+
 def main(argv=sys.argv[1:], tqdm_vers=tqdm_con):
     parser = argparse.ArgumentParser()
     parser.add_argument('--input', type=str, 
@@ -114,42 +246,206 @@ def main(argv=sys.argv[1:], tqdm_vers=tqdm_con):
     parser.add_argument('--meta_json', type=str, default='wd2_unified_label_policy.json',
                         help="category meta json file")
     parser.add_argument('--trg_dataset', type=str, default="wd2eval",
-                        help="category meta json file")
+                        help="target dataset name(s) of meta json file; use a comma-separated list to remap into multiple targets in one pass (output paths get a _<trg_dataset> postfix unless they contain {trg_dataset})")
     parser.add_argument('--annotation_root', type=str, default=None,
-                        help="annotation masks root directory")
+                        help="annotation masks root directory or zip archive (optionally with folder: archive.zip/folder)")
     parser.add_argument('--output', type=str, 
                         help="Output json file path for result.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes for mask consolidation")
+    parser.add_argument('--async_io', type=int, default=4,
+                        help="Without --workers: read masks of this many frames ahead and write outputs in the background (0: synchronous I/O)")
     parser.add_argument('--skip_masks', action='store_true', help="Skips consolidation of stuff segments. Only creates a new json file.")
+    parser.add_argument('--outp_dir_sem', type=str, default=None,
+                        help="Directly create semantic uint8 pngs of the remapped masks in this directory (or zip archive *.zip or label store *.lstore[/folder])")
+    parser.add_argument('--outp_dir_inst', type=str, default=None,
+                        help="Directly create instance uint16 pngs of the remapped masks in this directory (or zip archive *.zip or label store *.lstore[/folder])")
+    parser.add_argument('--stream_json', action='store_true', help="Read and write annotations one by one (bounded memory for very large json files)")
+    parser.add_argument('--use_cache', action='store_true', help="Use/create a binary sidecar cache (<input>.cache.npz) for faster loading")
+    parser.add_argument('--incremental', action='store_true', help="Keep a manifest of finished masks; reruns skip masks whose outputs are up to date")
+    parser.add_argument('--profile', type=str, nargs='?', const='remap_coco_profile.json', default=None,
+                        help="Time all processing stages; writes a json report (default: remap_coco_profile.json) and prints a summary")
+    parser.add_argument('--zip_masks', action='store_true', help="Write remapped panoptic png masks into a zip archive (output path with .zip instead of .json)")
+    parser.add_argument('--store_masks', action='store_true', help="Write remapped panoptic ids into a memory-mapped label store (output path with .lstore instead of .json, see label_store.py)")
+    parser.add_argument('--append_store', action='store_true', help="Add masks to existing label stores (--store_masks, <name>.lstore outputs) instead of refusing to overwrite them")
+    parser.add_argument('--append_zip', action='store_true', help="Add masks to existing zip archives (--zip_masks, <name>.zip outputs) instead of refusing to overwrite them")
+    parser.add_argument('--skip_pano_pngs', action='store_true', help="Do not write remapped panoptic png masks (use with --outp_dir_sem/--outp_dir_inst).")
     
     args = parser.parse_args(argv)
-    args.input, args.output = to_abspath(args.input), to_abspath(args.output)
+    take_deferred_writes() #discard writes left over by other callers in this process
+    args.input = to_abspath(args.input)
     if args.annotation_root is None:
         args.annotation_root = args.input[:-5]+'/'
     else:
         args.annotation_root = to_abspath(args.annotation_root)+'/'
-    if not os.path.exists(args.annotation_root):
+    if not mask_source(args.annotation_root).is_valid():
         print("Error: mask directory "+args.annotation_root+" is invalid!")
         return -1
-    trg_dir = args.output[:-5]+'/' if not args.skip_masks else None
-    if not trg_dir is None and not os.path.exists(trg_dir):
-        os.makedirs(trg_dir)
+    do_segm = args.outp_dir_sem or args.outp_dir_inst
+    prof = profile_new() if args.profile else None
     
     meta0 = json.load(open(args.meta_json))
-    src_to_trg, src_is_thing, trg_is_thing, trgcats =  remapings_from_json(meta0, args.trg_dataset)
-    if not src_to_trg:
-      return -2
+    trg_datasets = [t.strip() for t in args.trg_dataset.split(',') if t.strip()]
+    is_multi = len(trg_datasets) > 1
+    targets = []
+    for trg_dataset in trg_datasets:
+        src_to_trg, src_is_thing, trg_is_thing, trgcats =  remapings_from_json(meta0, trg_dataset)
+        if not src_to_trg:
+          return -2
+        output = to_abspath(trg_dataset_path(args.output, trg_dataset, is_multi))
+        targets.append({'src_to_trg': src_to_trg, 'src_is_thing': src_is_thing, 'trg_is_thing': trg_is_thing, 'trgcats': trgcats, 'output': output,
+                        'trg_dir': output[:-5]+('.lstore/' if args.store_masks else '.zip/' if args.zip_masks else '/') if not args.skip_masks and not args.skip_pano_pngs else None,
+                        'outp_dir_sem': trg_dataset_path(args.outp_dir_sem, trg_dataset, is_multi),
+                        'outp_dir_inst': trg_dataset_path(args.outp_dir_inst, trg_dataset, is_multi),
+                        'is_thing': {cat["id"]: cat["isthing"] for cat in trgcats}})
+        for d in [targets[-1]['trg_dir'], targets[-1]['outp_dir_sem'], targets[-1]['outp_dir_inst']]:
+            if not args.append_store and is_existing_store(d):
+                print("Error: label store "+d+" exists already; use --append_store to add masks to it or remove it.")
+                return -1
+            if not args.append_zip and is_existing_zip(d):
+                print("Error: zip archive "+d+" exists already; use --append_zip to add masks to it or remove it.")
+                return -1
+            if not d is None:
+                make_output_dir(d)
+    if args.incremental and any(is_deferred_path(trg[k]) for trg in targets for k in ['trg_dir', 'outp_dir_sem', 'outp_dir_inst']):
+        print("Warning: incremental remapping is not supported for zip/label store outputs; remapping all masks.")
+        args.incremental = False
+    
     print("Loading source annotation file " + args.input + "...")
-    annots = json.load(open(args.input))
-    annots['categories'] = trgcats
-    annots_fixed = []
-    for annot in tqdm_vers(annots['annotations'], desc='Remapping annotations'):
-        remap0 = remap_annotation(annot, src_to_trg=src_to_trg, src_is_thing=src_is_thing, trg_is_thing=trg_is_thing, src_dir=args.annotation_root, trg_dir=trg_dir)
-        annots_fixed.append(remap0)
-    annots['annotations']=annots_fixed
+    if args.use_cache:
+        with prof_stage(prof, 'cache_load'):
+            cache = pano_cache_load(args.input)
+        annots = dict(cache.meta)
+        annots_src, num_annots = cache.iter_annotations(), len(cache)
+    elif args.stream_json:
+        with prof_stage(prof, 'json_parse'):
+            annots = json_load_skip(args.input, ['annotations'])
+        annots_src, num_annots = json_iter_items(args.input, 'annotations'), None
+    else:
+        with prof_stage(prof, 'json_parse'):
+            annots = json.load(open(args.input))
+        annots_src, num_annots = annots['annotations'], len(annots['annotations'])
+    id2image = {image["id"]: image for image in annots.get("images",[])}
+    
+    #yields per source annotation: list of remapped annotations per target, mask job
+    def remap_frames():
+        for annot in annots_src:
+            remapped, trg_jobs = [], []
+            for i, trg in enumerate(targets):
+                #last target may change the source annotation inplace, all others work on copies
+                annot0 = annot if i+1 == len(targets) else dict(annot, segments_info=[dict(s) for s in annot['segments_info']])
+                remap0, joins = remap_annotation_segms(annot0, src_to_trg=trg['src_to_trg'], src_is_thing=trg['src_is_thing'], trg_is_thing=trg['trg_is_thing'], join_stuff=not args.skip_masks)
+                remapped.append(remap0)
+                semantic_name = None
+                if do_segm and remap0['image_id'] in id2image:
+                    semantic_name = id2image[remap0['image_id']]["file_name"].replace(".jpg", "_labelIds.png")
+                trg_jobs.append((joins, remap0['segments_info'], semantic_name))
+            yield remapped, (annot['file_name'], trg_jobs)
+    
+    manifest_path = targets[0]['output']+'.manifest.json'
+    manifest = manifest_load(manifest_path) if args.incremental else {'frames': {}}
+    joined_stats_fr = manifest.setdefault('joined_stats', {}) #exact joined segment stats per mask (reused for skipped masks)
+    do_masks = not args.skip_masks and not args.skip_pano_pngs or do_segm
+    use_async = do_masks and args.async_io > 0 and args.workers <= 1
+    if do_masks:
+        ctx = {'src_dir': args.annotation_root, 'targets': [{k: trg[k] for k in ['trg_dir', 'outp_dir_sem', 'outp_dir_inst', 'is_thing']} for trg in targets],
+               'incremental': args.incremental}
+        ctx['params_fp'] = params_fingerprint('remap_coco', ctx)
+        ctx['profile'] = not prof is None
+        ctx['mask_src'] = mask_source(args.annotation_root)
+        frames_src = prof_iter(prof, 'json_remap', remap_frames())
+        if use_async:
+            #masks are decoded ahead unless they are only copied (or fingerprinted first in incremental mode)
+            def prefetch_key(f):
+                file_name, trg_jobs = f[1]
+                return file_name, not args.incremental and any(len(joins) > 0 or (do_segm and not semantic_name is None) for joins, _, semantic_name in trg_jobs)
+            ctx['mask_src'] = PrefetchSource(ctx['mask_src'])
+            frames_src = read_ahead(frames_src, ctx['mask_src'], prefetch_key, depth=args.async_io)
+            defer_file_writes(True)
+        frames = pool_imap(remap_mask_worker, frames_src, workers=args.workers, ctx=ctx, task=lambda f: (f[1], manifest['frames'].get(f[1][0]) if f[1][0] in joined_stats_fr else None))
+    else:
+        frames = ((f, (None, None, False, None, None, [])) for f in prof_iter(prof, 'json_remap', remap_frames()))
+    json_writers = contextlib.ExitStack() #removes the temporary files of the stream writers unless remapping finishes
+    failures, cnt_skipped, deferred_outputs = [], 0, DeferredOutputs(writer=AsyncWriter(args.async_io) if use_async else None, append_stores=args.append_store, append_zips=args.append_zip)
+    pending_fps = {} #fingerprints of successful masks whose outputs are not yet confirmed as written
+    #outputs of successful masks which could not be written in the background
+    def write_failed(errors):
+        for file_name, err in errors:
+            if not file_name is None:
+                failures.append((file_name, err))
+                pending_fps.pop(file_name, None)
+                manifest['frames'].pop(file_name, None)
+                joined_stats_fr.pop(file_name, None)
+    #record masks in the manifest only once their outputs are written
+    def write_done(file_names):
+        for file_name in file_names:
+            if file_name in pending_fps:
+                manifest['frames'][file_name] = pending_fps.pop(file_name)
+    try:
+        if args.stream_json:
+            annots_fixed = []
+            for trg in targets:
+                annots_fixed.append(JsonStreamWriter(trg['output'], dict(annots, categories=trg['trgcats']), 'annotations'))
+                json_writers.callback(annots_fixed[-1].abort)
+        else:
+            annots_fixed = [[] for _ in targets]
+        for (remapped, job), (err, fp, skipped, joined_stats, frame_prof, deferred_writes) in tqdm_vers(frames, desc='Remapping annotations', total=num_annots):
+            if not frame_prof is None:
+                profile_merge(prof, frame_prof)
+                profile_frame(prof, job[0], frame_prof['stages']['frame'][1])
+            deferred_outputs.write(deferred_writes, prof, tag=job[0] if err is None else None)
+            if not err is None:
+                failures.append((job[0], err))
+                manifest['frames'].pop(job[0], None)
+                joined_stats_fr.pop(job[0], None)
+            elif not fp is None:
+                manifest['frames'].pop(job[0], None)
+                pending_fps[job[0]] = fp
+                cnt_skipped += int(skipped)
+                if skipped:
+                    joined_stats = joined_stats_fr[job[0]]
+                else:
+                    joined_stats_fr[job[0]] = joined_stats
+            for k, (out, remap0) in enumerate(zip(annots_fixed, remapped)):
+                if not joined_stats is None:
+                    apply_joined_stats(remap0, joined_stats[k])
+                if args.stream_json:
+                    with prof_stage(prof, 'json_write'):
+                        out.write_item(remap0)
+                else:
+                    out.append(remap0)
+            write_failed(deferred_outputs.take_errors())
+            write_done(deferred_outputs.take_done())
+            if args.incremental:
+                manifest_save(manifest, manifest_path, min_interval=10)
+        json_writers.pop_all()
+    finally:
+        json_writers.close()
+        deferred_outputs.close()
+        write_failed(deferred_outputs.take_errors())
+        write_done(deferred_outputs.take_done())
+        if use_async:
+            ctx['mask_src'].close()
+            defer_file_writes(False)
+        if args.incremental:
+            manifest_save(manifest, manifest_path)
+    if len(failures) > 0:
+        print("Warning: %i masks failed: "%len(failures), failures)
+    if cnt_skipped > 0:
+        print("Skipped %i masks which are up to date."%cnt_skipped)
     
-    print("Writing output to: "+args.output)
-    json.dump(annots, open(args.output,'w'))
+    for trg, annots_fixed0 in zip(targets, annots_fixed):
+        print("Writing output to: "+trg['output'])
+        with prof_stage(prof, 'json_write'):
+            if args.stream_json:
+                annots_fixed0.close()
+                continue
+            annots['categories'] = trg['trgcats']
+            annots['annotations'] = annots_fixed0
+            json.dump(annots, open(trg['output'],'w'))
     
+    if not prof is None:
+        print(profile_report(prof, args.profile))
     return 0
     
 if __name__ == "__main__":
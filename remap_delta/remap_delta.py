@@ -12,8 +12,32 @@
 import os
 import sys
 import glob
+import time
+import concurrent.futures
 import json
 import argparse
+import itertools
+import contextlib
+try:
+    import numpy as np
+except ImportError:
+    np = None #batch cross check (remap_inplace_onefrm_batch) needs numpy
+#optional helpers of wilddash_scripts (json_stream.py, stage_profile.py on the python path, e.g. PYTHONPATH=..);
+#the standalone tool works without them (--stream_json/--profile are disabled)
+try:
+    from json_stream import json_iter_items, json_load_skip, JsonStreamWriter
+except ImportError:
+    json_iter_items = json_load_skip = JsonStreamWriter = None
+try:
+    from stage_profile import profile_new, profile_merge, profile_frame, profile_report, prof_stage, prof_iter
+except ImportError:
+    profile_new = profile_merge = profile_frame = profile_report = None
+    def prof_stage(prof, name):
+        return contextlib.nullcontext()
+    def prof_iter(prof, name, iterable):
+        return iterable
+
+batch_min_segms = 8 #below this number of delta segments per frame, the numpy overhead outweighs the batch cross check
 
 def tqdm_none(l, total=None):
     return l
@@ -63,8 +87,77 @@ def poly2bbox(poly0):
     ret_coords = [int(c+0.5) for c in ret_coords]
     return ret_coords[0:2]+[ret_coords[2]-ret_coords[0]+1, ret_coords[3]-ret_coords[1]+1]
 
+#vectorized bbox_diff(...) > max_diff for two arrays of bboxes (n x 4); non-overlapping bboxes are always a mismatch
+def bbox_mismatch_batch(bboxs0, bboxs1, max_diff):
+    p_max0, p_max1 = bboxs0[:,:2]+bboxs0[:,2:], bboxs1[:,:2]+bboxs1[:,2:]
+    top_left = np.maximum(bboxs0[:,:2], bboxs1[:,:2])
+    bottom_right = np.minimum(p_max0, p_max1)
+    no_overlap = np.any(top_left > bottom_right, axis=1)
+    bottom_right = top_left+(bottom_right-top_left) #same operations as bbox_diff (identical float rounding)
+    lt_diff = np.maximum(np.abs(top_left-bboxs0[:,:2]), np.abs(top_left-bboxs1[:,:2])).max(axis=1)
+    br_diff = np.maximum(np.abs(bottom_right-p_max0), np.abs(bottom_right-p_max1)).max(axis=1)
+    return no_overlap | (np.maximum(lt_diff, br_diff) > max_diff)
+
+#vectorized poly2bbox for a list of polygons; returns array (n x 4)
+def poly2bbox_batch(polys):
+    lens = np.array([len(p) for p in polys], dtype=np.int64)
+    if len(polys) == 0 or np.any(lens == 0):
+        return np.array([poly2bbox(p) for p in polys], dtype=np.int64).reshape((-1,4)) #empty polygons raise like poly2bbox
+    verts = np.fromiter(itertools.chain.from_iterable(itertools.chain.from_iterable(polys)), dtype=np.float64)
+    if len(verts) != 2*lens.sum():
+        return np.array([poly2bbox(p) for p in polys], dtype=np.int64).reshape((-1,4)) #vertices are not 2d points
+    verts = verts.reshape((-1,2))
+    offsets = np.concatenate([[0], np.cumsum(lens)[:-1]])
+    coords = np.trunc(np.concatenate([np.minimum.reduceat(verts, offsets, axis=0), np.maximum.reduceat(verts, offsets, axis=0)], axis=1)+0.5).astype(np.int64)
+    return np.concatenate([coords[:,:2], coords[:,2:]-coords[:,:2]+1], axis=1)
+
+#same as remap_inplace_onefrm but all bboxes (incl. polygon bboxes) of one frame are cross checked at once using numpy;
+#returns identical errors and success count (categories are still checked/changed in delta order)
+def remap_inplace_onefrm_batch(change_segminfo, delta_segminfo, cross_check_delta=1):
+    if len(change_segminfo) == 0 or "label" in change_segminfo[0]:
+        id2idx = {i:i for i in range(len(change_segminfo))} #Cityscape uses index in list instead of ids
+    else:
+        id2idx = {a['id']:i for i,a in enumerate(change_segminfo)}
+    srcs = [change_segminfo[id2idx[d['id']]] for d in delta_segminfo]
+    checked, mismatch = [False]*len(srcs), [False]*len(srcs)
+    if cross_check_delta >= 0:
+        bbox_checks = [src0.get('bbox') for src0 in srcs]
+        poly_idx = [i for i, src0 in enumerate(srcs) if bbox_checks[i] is None and 'polygon' in src0]
+        for i, bbox in zip(poly_idx, poly2bbox_batch([srcs[i]['polygon'] for i in poly_idx]).tolist()):
+            bbox_checks[i] = bbox
+        check_idx = [i for i, bbox in enumerate(bbox_checks) if not bbox is None]
+        if len(check_idx) > 0:
+            bboxs_src = np.array([bbox_checks[i] for i in check_idx])
+            mism = bbox_mismatch_batch(np.array([delta_segminfo[i]['bbox'] for i in check_idx]), bboxs_src, cross_check_delta)
+            #check visible rendered bbox (after occlusions)
+            has_vis = np.array(['bbox_vis' in delta_segminfo[i] for i in check_idx])
+            if np.any(mism & has_vis):
+                bboxs_vis = np.array([delta_segminfo[i].get('bbox_vis', delta_segminfo[i]['bbox']) for i in check_idx])
+                mism &= ~has_vis | bbox_mismatch_batch(bboxs_vis, bboxs_src, cross_check_delta)
+            for i, m in zip(check_idx, mism.tolist()):
+                checked[i], mismatch[i] = True, m
+    ret_errors, success_cnt = [], 0
+    for i, (d, src0) in enumerate(zip(delta_segminfo, srcs)):
+        trg_attr = 'label' if 'label' in src0 else 'category_id'
+        if checked[i]:
+            #reject if delta information is not matching
+            if mismatch[i]:
+                ret_errors.append((d['id'],'Mismatch of bbox'))
+                continue
+            if d['old'] != src0[trg_attr]:
+                ret_errors.append((d['id'],'Mismatch of category_id'))
+                continue
+        src0[trg_attr] = d['new']
+        success_cnt += 1
+        if 'is_crowd' in src0 and 'is_crowd' in d:
+            src0['is_crowd'] = d['is_crowd']
+    return ret_errors, success_cnt
+
 #change category_id/label of dict change_segminfo inplace using delta infomtation from delta_segminfo
+#(uses remap_inplace_onefrm_batch for frames with many delta segments if numpy is available)
 def remap_inplace_onefrm(change_segminfo, delta_segminfo, cross_check_delta=1):
+    if not np is None and len(delta_segminfo) >= batch_min_segms:
+        return remap_inplace_onefrm_batch(change_segminfo, delta_segminfo, cross_check_delta=cross_check_delta)
     if len(change_segminfo) == 0 or "label" in change_segminfo[0]:
         id2idx = {i:i for i in range(len(change_segminfo))} #Cityscape uses index in list instead of ids
     else:
@@ -96,6 +189,31 @@ def remap_inplace_onefrm(change_segminfo, delta_segminfo, cross_check_delta=1):
 
 def json_read(p):
     return json.load(open(p))
+
+#write json to a temporary file next to p and rename it (readers never see half-written files)
+def json_write_atomic(content, p):
+    with open(p+'.tmp', 'wt') as ofile:
+        json.dump(content, ofile)
+    os.replace(p+'.tmp', p)
+
+#load one polygon json (Cityscapes, IDD), apply all its delta segment infos in order and write it back only if anything changed
+#returns list of (errors, success count) per delta segment info and the profile of this file (None if profile is False)
+def remap_polygon_file(path, delta_segminfos, cross_check_delta=1, profile=False):
+    prof = profile_new() if profile else None
+    with prof_stage(prof, 'frame'):
+        with prof_stage(prof, 'json_parse'):
+            src_one_json = json_read(path)
+        ret = []
+        for segminfo in delta_segminfos:
+            with prof_stage(prof, 'remap'):
+                ret.append(remap_inplace_onefrm(src_one_json['objects'], segminfo, cross_check_delta=cross_check_delta))
+        if sum(r[1] for r in ret) > 0:
+            with prof_stage(prof, 'json_write'):
+                json_write_atomic(src_one_json, path)
+    return ret, prof
+
+def _remap_polygon_task(task):
+    return remap_polygon_file(*task)
         
 #change old/new attribute labels to category ids
 def delta_label2catid_inplace(delta_segminfo, cats2ids):
@@ -103,78 +221,167 @@ def delta_label2catid_inplace(delta_segminfo, cats2ids):
         d['old'] = cats2ids[d['old']]
         d['new'] = cats2ids[d['new']]
 
+#append categories of a delta file to trg_cats; categories whose (canonized) name already exists are reused (not duplicated)
+def merge_delta_categories(trg_cats, add_cats):
+    known_names = set(canonize_name(c['name']) for c in trg_cats)
+    id_nxt = max(max([c.get('id',0) for c in trg_cats])+1,len(trg_cats))
+    for c in add_cats:
+        if canonize_name(c['name']) in known_names:
+            continue
+        c['id'] = id_nxt
+        trg_cats.append(c)
+        known_names.add(canonize_name(c['name']))
+        id_nxt += 1
+
 # change_path: a panoptic json (MVD, WD2) or a folder of polygon jsons (Cityscapes, IDD) to be changed (inplace!)
-# delta_path: path to delta remap information file
+# delta_path: path to delta remap information file or list of paths; a list of deltas is applied in order within one load/save cycle
+#             and the results (errors, warnings, success_cnt) are returned as lists with one entry per delta file
 # cross_check_delta: ensures that only delta infomation matching the src information which will be applied; use -1 to turn off
 #                    (the default of 1 ensures that rounding errors at bbox are ignored)
 # tqdm_vers: call with tqdm_nb from jupyter notebooks for correct tqdm repr. or tqdm_none for silence
-def remap_inplace_json(change_path, delta_path, cross_check_delta=1, tqdm_vers=tqdm_con):
-    delta0 = json_read(delta_path)
+# stream_json: read/write the annotations of a panoptic json one by one (bounded memory for very large files)
+# prof: optional profile (see stage_profile.py) which receives per-stage timings and the slowest frames
+# workers: number of worker processes for a folder of polygon jsons (<= 1: single process)
+def remap_inplace_json(change_path, delta_path, cross_check_delta=1, tqdm_vers=tqdm_con, stream_json=False, prof=None, workers=1):
+    delta_paths = [delta_path] if isinstance(delta_path, str) else list(delta_path)
+    with prof_stage(prof, 'json_parse'):
+        deltas = [json_read(p) for p in delta_paths]
+    #all delta annotations in order of application; delta_src[n]: index of the delta file of annotation n
+    delta_annots = [d for delta0 in deltas for d in delta0['annotations']]
+    delta_src = [k for k, delta0 in enumerate(deltas) for d in delta0['annotations']]
     is_json_dir = os.path.isdir(change_path)
-    success_cnt = 0
+    stream_json = stream_json and not is_json_dir and not json_iter_items is None
+    success_cnts = [0]*len(deltas)
     if is_json_dir:
-        jsons = glob.glob(change_path+'/**/*.json', recursive=True)
-        #find json file per delta change request
-        id2annot = {path2fn(p, check_folder=True):p for p in jsons}
+        with prof_stage(prof, 'file_scan'):
+            jsons = glob.glob(change_path+'/**/*.json', recursive=True)
+            #find json file per delta change request
+            id2annot = {path2fn(p, check_folder=True):p for p in jsons}
     else:
-        json0 = json_read(change_path)
-        add_cats = delta0['categories']
+        with prof_stage(prof, 'json_parse'):
+            json0 = json_load_skip(change_path, ['annotations']) if stream_json else json_read(change_path)
         trg_cats = json0['categories']
         #add new categories to old list
-        id_nxt = max(max([c.get('id',0) for c in trg_cats])+1,len(trg_cats))
-        for c in add_cats:
-            c['id'] = id_nxt
-            trg_cats.append(c)
-            id_nxt += 1
+        for delta0 in deltas:
+            merge_delta_categories(trg_cats, delta0['categories'])
         #find annotation per delta change request
         cats2ids = {canonize_name(c['name']):c.get('id',i) for i,c in enumerate(trg_cats)}
-        id2annot = {path2fn(str(a['image_id'])):a for a in json0['annotations']}
-        
-    errors, warnings = [], []
-    for d in tqdm_vers(delta0['annotations']):
-        dfn = path2fn(d['image_id'])
-        if not dfn in id2annot:
-            warnings.append((dfn,"image_id not found in src"))
-            continue
-        if not is_json_dir:
+        if not stream_json:
+            id2annot = {path2fn(str(a['image_id'])):a for a in json0['annotations']}
+
+    #errors per delta annotation (None: image_id not found in src); reported in delta order
+    delta_errors = [None]*len(delta_annots)
+    if stream_json:
+        #stream annotations of change_path and apply matching delta annotations
+        dfn2deltas = {}
+        for n, d in enumerate(delta_annots):
+            dfn2deltas.setdefault(path2fn(d['image_id']),[]).append(n)
+        with JsonStreamWriter(change_path, json0, 'annotations') as writer:
+            for a in tqdm_vers(prof_iter(prof, 'json_parse', json_iter_items(change_path, 'annotations'))):
+                dfn = path2fn(str(a['image_id']))
+                for n in dfn2deltas.pop(dfn, []):
+                    d = delta_annots[n]
+                    with prof_stage(prof, 'remap'):
+                        delta_label2catid_inplace(d['segments_info'], cats2ids)
+                        errors0, success0 = remap_inplace_onefrm(a['segments_info'], d['segments_info'], cross_check_delta=cross_check_delta)
+                    delta_errors[n] = errors0
+                    success_cnts[delta_src[n]] += success0
+                with prof_stage(prof, 'json_write'):
+                    writer.write_item(a)
+    elif is_json_dir:
+        #polygon jsons are processed in parallel; each file is loaded and (if changed) written once for all its delta annotations
+        path2deltas = {}
+        for n, d in enumerate(delta_annots):
+            dfn = path2fn(d['image_id'])
+            if dfn in id2annot:
+                path2deltas.setdefault(id2annot[dfn],[]).append(n)
+        tasks = [(p, [delta_annots[n]['segments_info'] for n in idxs], cross_check_delta, not prof is None) for p, idxs in path2deltas.items()]
+        with concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 else contextlib.nullcontext() as executor:
+            if workers <= 1:
+                results = map(_remap_polygon_task, tasks)
+            else:
+                results = executor.map(_remap_polygon_task, tasks, chunksize=max(1, min(64, len(tasks)//(workers*8))))
+            for idxs, (ret, frame_prof) in zip(path2deltas.values(), tqdm_vers(results, total=len(tasks))):
+                for n, (errors0, success0) in zip(idxs, ret):
+                    delta_errors[n] = errors0
+                    success_cnts[delta_src[n]] += success0
+                if not frame_prof is None:
+                    profile_merge(prof, frame_prof)
+                    profile_frame(prof, path2fn(delta_annots[idxs[0]]['image_id']), frame_prof['stages']['frame'][1])
+    else:
+        for n, d in enumerate(tqdm_vers(delta_annots)):
+            dfn = path2fn(d['image_id'])
+            if not dfn in id2annot:
+                continue
+            t0 = time.perf_counter()
             delta_label2catid_inplace(d['segments_info'], cats2ids)
-            src_change = id2annot[dfn]['segments_info']
-        else:
-            src_one_json = json_read(id2annot[dfn])
-            src_change = src_one_json['objects']
-        errors0, success0 = remap_inplace_onefrm(src_change, d['segments_info'], cross_check_delta=cross_check_delta)
-        errors += [[dfn,e[0],e[1]] for e in errors0]
-        success_cnt += success0
-        if is_json_dir:
-            json.dump(src_one_json,open(id2annot[dfn],'wt'))
-    if not is_json_dir:
+            with prof_stage(prof, 'remap'):
+                delta_errors[n], success0 = remap_inplace_onefrm(id2annot[dfn]['segments_info'], d['segments_info'], cross_check_delta=cross_check_delta)
+            success_cnts[delta_src[n]] += success0
+            if not prof is None:
+                profile_frame(prof, dfn, time.perf_counter()-t0)
         #store result inplace (make dublicates before calling this function if you want to keep the original!)
         json0['categories'] = trg_cats
-        json.dump(json0,open(change_path,'wt'))
-    return errors, warnings, success_cnt
+        with prof_stage(prof, 'json_write'):
+            json.dump(json0,open(change_path,'wt'))
+
+    errors, warnings = [[] for _ in deltas], [[] for _ in deltas]
+    for n, d in enumerate(delta_annots):
+        dfn = path2fn(d['image_id'])
+        if delta_errors[n] is None:
+            warnings[delta_src[n]].append((dfn,"image_id not found in src"))
+        else:
+            errors[delta_src[n]] += [[dfn,e[0],e[1]] for e in delta_errors[n]]
+    if isinstance(delta_path, str):
+        return errors[0], warnings[0], success_cnts[0]
+    return errors, warnings, success_cnts
 
 def downl_main(argv=sys.argv[1:]):
     parser = argparse.ArgumentParser()
     parser.add_argument('--change_path', type=str, default=None,
                         help="Changes are applied directly to this file or json files if supplied a folder. Either path to a panoptic COCO json (MVD, WD2) or a folder of polygon information jsons (Cityscapes, IDD)")
-    parser.add_argument('--delta_path', type=str, default=None,
-                        help="Delta remap information json file")
+    parser.add_argument('--delta_path', type=str, nargs='+', default=None,
+                        help="Delta remap information json file(s); multiple files are applied in the given order with a single load/save of change_path")
     parser.add_argument('--cross_check_delta', type=int, default=1,
                         help="Cross check delta information to ensure correct segments are mapped. Use -1 to turn off")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes for a folder of polygon jsons")
+    parser.add_argument('--stream_json', action='store_true', help="Read/write annotations of a panoptic json one by one (bounded memory for very large files)")
+    parser.add_argument('--profile', type=str, nargs='?', const='remap_delta_profile.json', default=None,
+                        help="Time all processing stages; writes a json report (default: remap_delta_profile.json) and prints a summary")
     parser.add_argument('--silent', action='store_true', help="Suppress all outputs")
     parser.add_argument('--verbose', action='store_true', help="Print extra information")
     args = parser.parse_args(argv)
     tqdm_vers = tqdm_none if args.silent else tqdm_con
-    errors, warnings, success_cnt = remap_inplace_json(change_path = args.change_path, 
-                                                       delta_path = args.delta_path, 
-                                                       cross_check_delta = args.cross_check_delta,
-                                                       tqdm_vers = tqdm_vers)
+    if args.stream_json and json_iter_items is None:
+        if not args.silent:
+            print("Warning: --stream_json needs json_stream.py of wilddash_scripts on the python path; reading the whole json.")
+        args.stream_json = False
+    if args.profile and profile_new is None:
+        if not args.silent:
+            print("Warning: --profile needs stage_profile.py of wilddash_scripts on the python path; profiling is disabled.")
+        args.profile = None
+    prof = profile_new() if args.profile else None
+    errors, warnings, success_cnts = remap_inplace_json(change_path = args.change_path, 
+                                                        delta_path = args.delta_path, 
+                                                        cross_check_delta = args.cross_check_delta,
+                                                        tqdm_vers = tqdm_vers,
+                                                        stream_json = args.stream_json,
+                                                        prof = prof,
+                                                        workers = args.workers)
     if not args.silent:
-        print("Finished delta remapping opertation with %i successes, %i warnings, and %i errors."%(success_cnt, len(warnings), len(errors)))
-        if args.verbose and len(warnings) > 0:
-            print("Generated these warnings: ", warnings)
-        if args.verbose and len(errors) > 0:
-            print("Generated these errors: ", warnings)
+        for k, delta_path in enumerate(args.delta_path):
+            if len(args.delta_path) > 1:
+                print("Delta file %s:"%delta_path)
+            print("Finished delta remapping opertation with %i successes, %i warnings, and %i errors."%(success_cnts[k], len(warnings[k]), len(errors[k])))
+            if args.verbose and len(warnings[k]) > 0:
+                print("Generated these warnings: ", warnings[k])
+            if args.verbose and len(errors[k]) > 0:
+                print("Generated these errors: ", errors[k])
+    if not prof is None:
+        summary = profile_report(prof, args.profile)
+        if not args.silent:
+            print(summary)
 
 if __name__ == "__main__":
     sys.exit(downl_main())
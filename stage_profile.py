@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# low-overhead per-stage timers/counters for the conversion tools (--profile option)
+# a profile is a plain dict (picklable, so worker processes can return per-frame profiles which are merged by the caller)
+#
+# example:
+# prof = profile_new()
+# with prof_stage(prof, 'png_decode'):
+#     bgr = cv2.imread(p)
+# profile_report(prof, 'profile.json')
+#
+# see https://github.com/ozendelait/wilddash_scripts
+#
+# Use this tool on your own risk!
+# Copyright (C) 2023 AIT Austrian Institute of Technology GmbH
+# All rights reserved.
+#******************************************************************************
+
+import json
+import time
+import heapq
+import contextlib
+
+def profile_new():
+    return {'start': time.time(), 'stages': {}, 'slowest_frames': []}
+
+#add one measurement of stage name (stages entries: [count, total seconds, max seconds])
+def profile_add(prof, name, seconds, count=1):
+    st = prof['stages'].setdefault(name, [0, 0.0, 0.0])
+    st[0] += count
+    st[1] += seconds
+    st[2] = max(st[2], seconds)
+
+#time the enclosed block as stage name; does nothing if prof is None
+@contextlib.contextmanager
+def prof_stage(prof, name):
+    if prof is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile_add(prof, name, time.perf_counter()-t0)
+
+#wrap an iterable; time needed to fetch each item is added to stage name (e.g. streaming json parsing)
+def prof_iter(prof, name, iterable):
+    if prof is None:
+        yield from iterable
+        return
+    it = iter(iterable)
+    while True:
+        t0 = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            profile_add(prof, name, time.perf_counter()-t0, count=0)
+            return
+        profile_add(prof, name, time.perf_counter()-t0)
+        yield item
+
+#remember the slowest num_keep frames
+def profile_frame(prof, frame_name, seconds, num_keep=20):
+    if prof is None:
+        return
+    entry = [seconds, frame_name]
+    if len(prof['slowest_frames']) < num_keep:
+        heapq.heappush(prof['slowest_frames'], entry)
+    else:
+        heapq.heappushpop(prof['slowest_frames'], entry)
+
+#merge stage measurements (e.g. returned from a worker process) of other into prof
+def profile_merge(prof, other):
+    if prof is None or other is None:
+        return
+    for name, (count, total, max0) in other['stages'].items():
+        st = prof['stages'].setdefault(name, [0, 0.0, 0.0])
+        st[0] += count
+        st[1] += total
+        st[2] = max(st[2], max0)
+
+#write json report to report_path (optional) and return a short human-readable summary
+#note: with worker processes, stage totals are summed over all workers and can exceed the wall time
+def profile_report(prof, report_path=None):
+    wall = time.time()-prof['start']
+    stages = {name: {'count': c, 'total_s': t, 'mean_ms': 1000.0*t/max(c, 1), 'max_ms': 1000.0*m, 'percent_of_wall': 100.0*t/max(wall, 1e-9)}
+              for name, (c, t, m) in sorted(prof['stages'].items(), key=lambda s: -s[1][1])}
+    slowest = [{'frame': f, 'seconds': s} for s, f in sorted(prof['slowest_frames'], reverse=True)]
+    if report_path:
+        json.dump({'wall_s': wall, 'stages': stages, 'slowest_frames': slowest}, open(report_path, 'w'), indent=1)
+    lines = ["Profile (wall time %.2fs):"%wall, "  %-20s %9s %10s %10s %10s %7s"%("stage", "count", "total s", "mean ms", "max ms", "%wall")]
+    for name, st in stages.items():
+        lines.append("  %-20s %9i %10.3f %10.3f %10.3f %7.1f"%(name, st['count'], st['total_s'], st['mean_ms'], st['max_ms'], st['percent_of_wall']))
+    if len(slowest) > 0:
+        lines.append("  slowest frames: "+", ".join("%s (%.3fs)"%(s['frame'], s['seconds']) for s in slowest[:5]))
+    return "\n".join(lines)
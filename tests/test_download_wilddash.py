@@ -0,0 +1,201 @@
+# tests of download_helper/download_wilddash.py against a local stand-in of the wilddash.cc server
+# (login form with CSRF token, session cookie, HTTP Range requests, dropped connections)
+import hashlib
+import http.server
+import importlib.util
+import json
+import os
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "download_helper", "download_wilddash.py")
+_spec = importlib.util.spec_from_file_location("download_wilddash", _path)
+dw = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(dw)
+
+USERNAME, PASSWORD = "user@example.org", "p&?+=$@x"
+CSRF, SESSION = "tok123", "s1"
+SEND_BLOCK = 16 * 1024
+_sleep = time.sleep # the downloader's retry delay is disabled in the tests (time.sleep is patched)
+
+class StandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, files):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.files = files      # name -> content; names starting with 'norange' ignore Range requests
+        self.drop = set()       # (name, range start): drop the connection once after half of the body
+        self.fail = set()       # (name, range start): always drop the connection
+        self.slow = 0.0         # delay per sent block (to make chunk downloads overlap)
+        self.lock = threading.Lock()
+        self.stats = {"bytes": 0, "ranges": [], "conc": 0, "max_conc": 0}
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%i"%self.server_address[1]
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def cookies(self):
+        return dict(c.strip().split("=", 1) for c in self.headers.get("Cookie", "").split(";") if "=" in c)
+
+    def send_html(self, body, headers=()):
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        srv = self.server
+        if self.path.startswith("/accounts/login"):
+            return self.send_html("<form><input type='hidden' name='csrfmiddlewaretoken' value='%s'></form>"%CSRF, [("Set-Cookie", "csrftoken=c1; Path=/")])
+        if not self.path.startswith("/download/") or self.cookies().get("sessionid") != SESSION:
+            return self.send_html("login page")
+        name = self.path[len("/download/"):]
+        if not name in srv.files:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = srv.files[name]
+        rng = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", "")) if not name.startswith("norange") else None
+        start = int(rng.group(1)) if rng else 0
+        if rng:
+            end = min(int(rng.group(2)), len(data)-1)
+            body = data[start:end+1]
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %i-%i/%i"%(start, end, len(data)))
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Disposition", 'attachment; filename="%s"'%name)
+        self.end_headers()
+        with srv.lock:
+            if len(body) > 1:
+                srv.stats["ranges"].append((name, start))
+            drop = (name, start) in srv.fail or (name, start) in srv.drop
+            srv.drop.discard((name, start))
+            srv.stats["conc"] += 1
+            srv.stats["max_conc"] = max(srv.stats["max_conc"], srv.stats["conc"])
+        try:
+            for i in range(0, len(body), SEND_BLOCK):
+                if drop and len(body) > 1 and i >= len(body)//2:
+                    self.close_connection = True
+                    return
+                if srv.slow:
+                    _sleep(srv.slow)
+                self.wfile.write(body[i:i+SEND_BLOCK])
+                with srv.lock:
+                    srv.stats["bytes"] += len(body[i:i+SEND_BLOCK])
+        finally:
+            with srv.lock:
+                srv.stats["conc"] -= 1
+
+    def do_POST(self):
+        form = urllib.parse.parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+        ok = form.get("csrfmiddlewaretoken") == [CSRF] and self.cookies().get("csrftoken") == "c1" and \
+             form.get("username") == [USERNAME] and form.get("password") == [PASSWORD]
+        self.send_response(302)
+        self.send_header("Location", "/")
+        self.send_header("Content-Length", "0")
+        if ok:
+            self.send_header("Set-Cookie", "sessionid=%s; Path=/"%SESSION)
+        self.end_headers()
+
+KB = 1024
+CHUNK = 64 * KB
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("WILDDASH_USERNAME", USERNAME)
+    monkeypatch.setenv("WILDDASH_PASSWORD", PASSWORD)
+    monkeypatch.setattr(dw.time, "sleep", lambda s: None) # no waiting between retries
+    files = {name: os.urandom(size) for name, size in [("wd_a.zip", 5*CHUNK+123), ("wd_b.zip", 3*CHUNK), ("norange_c.zip", 2*CHUNK+7)]}
+    srv = StandInServer(files)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+def download(srv, dst_dir, names, **kwargs):
+    kwargs.setdefault("chunk_size", CHUNK)
+    return dw.download_wilddash_files(names, str(dst_dir), server_url=srv.url, verbose=False, **kwargs)
+
+def read(path):
+    with open(path, "rb") as ifile:
+        return ifile.read()
+
+def test_concurrent_chunks_with_dropped_connections(server, tmp_path):
+    server.slow = 0.005
+    server.drop = {("wd_a.zip", CHUNK), ("wd_a.zip", 3*CHUNK), ("wd_b.zip", 0)}
+    results = download(server, tmp_path, ["wd_a.zip", "wd_b.zip"], parallel_files=2, chunk_workers=3)
+    assert [r[2] for r in results] == [None, None]
+    for name, path, _ in results:
+        assert read(path) == server.files[name]
+        assert not os.path.exists(path+".part") and not os.path.exists(path+".part.json")
+    assert server.stats["max_conc"] > 1
+    # dropped chunks are requested again from the position reached
+    assert len([r for r in server.stats["ranges"] if r[0] == "wd_a.zip"]) == 6+2
+    assert os.path.exists(os.path.join(str(tmp_path), "wd_cookies_downl.txt"))
+
+def test_resume_from_part_state(server, tmp_path):
+    size = len(server.files["wd_a.zip"])
+    server.fail = {("wd_a.zip", 2*CHUNK), ("wd_a.zip", 4*CHUNK)}
+    results = download(server, tmp_path, ["wd_a.zip"], chunk_workers=2, retries=1)
+    assert not results[0][2] is None
+    part_path = os.path.join(str(tmp_path), "wd_a.zip")+".part"
+    state = json.load(open(part_path+".json"))
+    assert state["size"] == size and state["done"][2] < CHUNK and state["done"][0] == CHUNK
+    server.fail, server.stats["bytes"] = set(), 0
+    results = download(server, tmp_path, ["wd_a.zip"], chunk_workers=2)
+    assert results[0][2] is None and read(results[0][1]) == server.files["wd_a.zip"]
+    # only the missing parts of chunks 2 and 4 are downloaded again (+ the 1 byte probe)
+    assert server.stats["bytes"] <= 2*CHUNK - state["done"][2] - state["done"][4] + 1
+    assert not os.path.exists(part_path) and not os.path.exists(part_path+".json")
+
+def test_single_stream_without_range_support(server, tmp_path):
+    server.drop = {("norange_c.zip", 0)}
+    results = download(server, tmp_path, ["norange_c.zip"])
+    assert results[0][2] is None and read(results[0][1]) == server.files["norange_c.zip"]
+    assert len(server.stats["ranges"]) == 2 # dropped connection was retried
+
+def test_single_stream_size_failure(server, tmp_path):
+    server.fail = {("norange_c.zip", 0)}
+    results = download(server, tmp_path, ["norange_c.zip"], retries=2)
+    assert "Connection closed" in results[0][2]
+    assert not os.path.exists(os.path.join(str(tmp_path), "norange_c.zip"))
+
+def test_sha256_checksums(server, tmp_path):
+    good = hashlib.sha256(server.files["wd_b.zip"]).hexdigest()
+    with open(os.path.join(str(tmp_path), "sums.txt"), "w") as ofile:
+        ofile.write("%s  wd_b.zip\n%s  wd_a.zip\n"%(good, "0"*64))
+    checksums = dw.load_checksums(os.path.join(str(tmp_path), "sums.txt"))
+    results = dict((r[0], r) for r in download(server, tmp_path / "out", ["wd_a.zip", "wd_b.zip"], checksums=checksums))
+    assert results["wd_b.zip"][2] is None
+    assert "Checksum mismatch" in results["wd_a.zip"][2]
+    # corrupt data is removed so that the next run starts from scratch
+    dst = os.path.join(str(tmp_path), "out", "wd_a.zip")
+    assert not any(os.path.exists(p) for p in [dst, dst+".part", dst+".part.json"])
+
+def test_errors_login_and_missing_file(server, tmp_path, monkeypatch):
+    results = download(server, tmp_path, ["missing.zip"])
+    assert "404" in results[0][2]
+    monkeypatch.setenv("WILDDASH_PASSWORD", "wrong")
+    results = download(server, tmp_path / "other", ["wd_b.zip"])
+    assert "html page" in results[0][2]
@@ -0,0 +1,26 @@
+# tests of the memory-mapped label store (label_store.py)
+import os
+
+import cv2
+import numpy as np
+
+from label_store import LabelStore, label_store_main
+
+def write_pngs(root, dtype, num=3):
+    os.makedirs(root)
+    for k in range(num):
+        cv2.imwrite(os.path.join(root, "f%d.png"%k), np.full((4, 6), k+1, dtype=dtype))
+
+def test_cli_does_not_replace_existing_store(tmp_path):
+    write_pngs(str(tmp_path / "sem"), np.uint8)
+    write_pngs(str(tmp_path / "inst"), np.uint16)
+    store_path = str(tmp_path / "labels.lstore")
+    assert label_store_main(["--input_dir", str(tmp_path / "sem"), "--output", store_path+"/sem", "--silent"]) == 0
+    assert label_store_main(["--input_dir", str(tmp_path / "inst"), "--output", store_path+"/inst", "--append", "--silent"]) == 0
+    # rerunning the first command must not wipe the inst/ frames
+    assert label_store_main(["--input_dir", str(tmp_path / "sem"), "--output", store_path+"/sem", "--silent"]) == -1
+    store = LabelStore(store_path)
+    assert len(store) == 6
+    assert store["inst/f2.png"].dtype == np.uint16 and (store["inst/f2.png"] == 3).all()
+    assert label_store_main(["--input_dir", str(tmp_path / "sem"), "--output", store_path+"/sem", "--overwrite", "--silent"]) == 0
+    assert sorted(LabelStore(store_path).names()) == ["sem/f0.png", "sem/f1.png", "sem/f2.png"]
@@ -0,0 +1,205 @@
+# regression tests of the single-pass LUT painting in pano2sem.py against the original per-segment loop
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import async_io
+import pano2sem
+from pano2sem import paint_segments, panoptic2segm, panoptic_audit, segment_stats, intids_to_bgrids, tqdm_none
+
+IS_THING = {7: False, 11: False, 24: True, 26: True, 65: True, 66: True}
+
+# original implementation: paint each segment with a full-image comparison (ids == id0)
+def paint_segments_loop(ids, segments_info, is_thing):
+    semantic = np.zeros_like(ids, dtype="uint8")
+    instances = np.zeros_like(ids, dtype="uint16")
+    num_things = 1
+    for s in segments_info:
+        id0 = s["id"]
+        category_id = s["category_id"]
+        semantic[ids == id0] = category_id
+        if is_thing[category_id]:
+            instances[ids == id0] = category_id * 1000 + num_things
+            num_things += 1
+        else:
+            instances[ids == id0] = category_id
+    return semantic, instances
+
+def random_frame(rng, h=48, w=64, num_segs=12):
+    seg_ids = rng.choice(np.arange(1, 2**24), size=num_segs, replace=False).astype(np.uint32)
+    # id 0 and an id without segments_info entry: pixels with no segment
+    pixel_ids = np.concatenate([seg_ids, np.array([0, 2**24-1], dtype=np.uint32)])
+    ids = pixel_ids[rng.integers(0, len(pixel_ids), size=(h//4, w//4))].repeat(4, 0).repeat(4, 1)
+    cats = [7, 11, 24, 26, 65]
+    segments_info = [{"id": int(i), "category_id": int(cats[rng.integers(0, len(cats))])} for i in seg_ids]
+    # segments missing from the mask
+    segments_info += [{"id": int(i), "category_id": 26} for i in rng.integers(2**24, 2**25, size=2)]
+    # duplicate segment ids: later entries overwrite earlier ones (and count as things again)
+    segments_info += [dict(segments_info[0], category_id=24), dict(segments_info[3], category_id=7)]
+    order = rng.permutation(len(segments_info))
+    return ids, [segments_info[i] for i in order]
+
+@pytest.mark.parametrize("seed", range(5))
+def test_paint_segments_matches_loop(seed):
+    ids, segments_info = random_frame(np.random.default_rng(seed))
+    semantic, instances = paint_segments(ids, segments_info, IS_THING)
+    semantic0, instances0 = paint_segments_loop(ids, segments_info, IS_THING)
+    assert semantic.dtype == np.uint8 and instances.dtype == np.uint16
+    np.testing.assert_array_equal(semantic, semantic0)
+    np.testing.assert_array_equal(instances, instances0)
+
+def test_paint_segments_empty():
+    ids = np.zeros((8, 8), dtype=np.uint32)
+    semantic, instances = paint_segments(ids, [], IS_THING)
+    assert not semantic.any() and not instances.any()
+
+def test_paint_segments_instance_overflow():
+    # thing category 66: instance id 66001 does not fit into uint16 and must not wrap around
+    ids = np.full((4, 4), 5, dtype=np.uint32)
+    with pytest.raises(ValueError):
+        paint_segments(ids, [{"id": 5, "category_id": 66}], IS_THING)
+    # semantic images alone are not affected
+    semantic, _ = paint_segments(ids, [{"id": 5, "category_id": 66}], IS_THING, check_instances=False)
+    assert (semantic == 66).all()
+
+def write_dataset(root, frames):
+    os.makedirs(os.path.join(root, "panoptic"))
+    images, annotations = [], []
+    for k, (ids, segments_info) in enumerate(frames):
+        cv2.imwrite(os.path.join(root, "panoptic", "f%d.png"%k), intids_to_bgrids(ids))
+        images.append({"id": "f%d"%k, "file_name": "f%d.jpg"%k})
+        annotations.append({"image_id": "f%d"%k, "file_name": "f%d.png"%k, "segments_info": segments_info})
+    categories = [{"id": c, "isthing": int(t)} for c, t in IS_THING.items()]
+    json_path = os.path.join(root, "panoptic.json")
+    json.dump({"images": images, "annotations": annotations, "categories": categories}, open(json_path, "w"))
+    return json_path
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_panoptic2segm_pngs_byte_identical(tmp_path, workers):
+    rng = np.random.default_rng(1)
+    frames = [random_frame(rng) for _ in range(4)]
+    json_path = write_dataset(str(tmp_path), frames)
+    outp_sem, outp_inst, ref = [str(tmp_path / d) for d in ["sem", "inst", "ref"]]
+    os.makedirs(ref)
+    for k, (ids, segments_info) in enumerate(frames):
+        semantic0, instances0 = paint_segments_loop(ids, segments_info, IS_THING)
+        cv2.imwrite(os.path.join(ref, "f%d_labelIds.png"%k), semantic0)
+        cv2.imwrite(os.path.join(ref, "f%d_instanceIds.png"%k), instances0)
+    failures = []
+    assert panoptic2segm(json_path, outp_sem, outp_inst, tqdm_vers=tqdm_none, workers=workers, ret_failures=failures) == len(frames)
+    assert failures == []
+    for k in range(len(frames)):
+        for outp_dir, name in [(outp_sem, "f%d_labelIds.png"%k), (outp_inst, "f%d_instanceIds.png"%k)]:
+            with open(os.path.join(outp_dir, name), "rb") as f0, open(os.path.join(ref, name), "rb") as f1:
+                assert f0.read() == f1.read(), name
+
+def test_panoptic2segm_overflow_is_frame_error(tmp_path):
+    ids = np.full((8, 8), 5, dtype=np.uint32)
+    json_path = write_dataset(str(tmp_path), [(ids, [{"id": 5, "category_id": 66}]), (ids, [{"id": 5, "category_id": 65}])])
+    failures = []
+    assert panoptic2segm(json_path, str(tmp_path / "sem"), str(tmp_path / "inst"), tqdm_vers=tqdm_none, ret_failures=failures) == 1
+    assert [f[0] for f in failures] == ["f0.png"]
+    assert panoptic2segm(json_path, str(tmp_path / "sem_only"), tqdm_vers=tqdm_none) == 2
+
+def test_incremental_async_records_only_written_frames(tmp_path, monkeypatch):
+    rng = np.random.default_rng(2)
+    json_path = write_dataset(str(tmp_path), [random_frame(rng) for _ in range(3)])
+    outp_sem, outp_inst = str(tmp_path / "sem"), str(tmp_path / "inst")
+    # background writes lag behind: every manifest save may only contain frames whose outputs exist
+    run0, save0 = async_io.AsyncWriter._run, pano2sem.manifest_save
+    def slow_run(self):
+        time.sleep(0.2)
+        run0(self)
+    def checked_save(manifest, manifest_path, min_interval=0):
+        for file_name in manifest["frames"]:
+            name = file_name.replace(".png", "")
+            assert os.path.isfile(os.path.join(outp_sem, name+"_labelIds.png")), file_name
+            assert os.path.isfile(os.path.join(outp_inst, name+"_instanceIds.png")), file_name
+        save0(manifest, manifest_path)
+    monkeypatch.setattr(async_io.AsyncWriter, "_run", slow_run)
+    monkeypatch.setattr(pano2sem, "manifest_save", checked_save)
+    # a directory in place of an output png: the background write of frame f1 fails
+    os.makedirs(os.path.join(outp_sem, "f1_labelIds.png"))
+    failures = []
+    assert panoptic2segm(json_path, outp_sem, outp_inst, tqdm_vers=tqdm_none, ret_failures=failures, incremental=True, async_io=4) == 2
+    assert [f[0] for f in failures] == ["f1.png"]
+    manifest = json.load(open(os.path.join(outp_sem, ".pano2sem_manifest.json")))
+    assert sorted(manifest["frames"].keys()) == ["f0.png", "f2.png"]
+    assert not any(f.endswith(".tmp") for d in [outp_sem, outp_inst] for f in os.listdir(d))
+    # rerun: written frames are skipped, the failed frame is converted again
+    os.rmdir(os.path.join(outp_sem, "f1_labelIds.png"))
+    skipped = []
+    assert panoptic2segm(json_path, outp_sem, outp_inst, tqdm_vers=tqdm_none, incremental=True, ret_skipped=skipped, async_io=4) == 3
+    assert sorted(skipped) == ["f0.png", "f2.png"]
+
+def test_label_store_output_is_not_overwritten(tmp_path):
+    from label_store import LabelStore
+    rng = np.random.default_rng(3)
+    frames = [random_frame(rng) for _ in range(2)]
+    json_path = write_dataset(str(tmp_path), frames)
+    store_path = str(tmp_path / "labels.lstore")
+    assert panoptic2segm(json_path, outp_dir_sem=store_path+"/sem", tqdm_vers=tqdm_none) == 2
+    # a second run writing into the existing store must not wipe the semantic maps
+    with pytest.raises(ValueError):
+        panoptic2segm(json_path, outp_dir_inst=store_path+"/inst", tqdm_vers=tqdm_none)
+    assert panoptic2segm(json_path, outp_dir_inst=store_path+"/inst", tqdm_vers=tqdm_none, append_store=True) == 2
+    store = LabelStore(store_path)
+    assert sorted(store.names()) == ["inst/f0_instanceIds.png", "inst/f1_instanceIds.png", "sem/f0_labelIds.png", "sem/f1_labelIds.png"]
+    for k, (ids, segments_info) in enumerate(frames):
+        semantic0, instances0 = paint_segments_loop(ids, segments_info, IS_THING)
+        np.testing.assert_array_equal(store["sem/f%d_labelIds.png"%k], semantic0)
+        np.testing.assert_array_equal(store["inst/f%d_instanceIds.png"%k], instances0)
+
+def test_zip_output_is_not_overwritten(tmp_path):
+    import zipfile
+    rng = np.random.default_rng(4)
+    json_path = write_dataset(str(tmp_path), [random_frame(rng) for _ in range(2)])
+    zip_path = str(tmp_path / "labels.zip")
+    assert panoptic2segm(json_path, outp_dir_sem=zip_path+"/sem", tqdm_vers=tqdm_none) == 2
+    with pytest.raises(ValueError):
+        panoptic2segm(json_path, outp_dir_inst=zip_path+"/inst", tqdm_vers=tqdm_none)
+    assert panoptic2segm(json_path, outp_dir_inst=zip_path+"/inst", tqdm_vers=tqdm_none, append_zip=True) == 2
+    assert sorted(zipfile.ZipFile(zip_path).namelist()) == ["inst/f0_instanceIds.png", "inst/f1_instanceIds.png", "sem/f0_labelIds.png", "sem/f1_labelIds.png"]
+
+# reference: area and tight bbox ([x, y, width, height]) of the pixels of key from np.nonzero
+def stats_nonzero(ids, key):
+    ys, xs = np.nonzero(ids == key)
+    if len(xs) == 0:
+        return 0, [0, 0, 0, 0]
+    return len(xs), [int(xs.min()), int(ys.min()), int(xs.max()-xs.min()+1), int(ys.max()-ys.min()+1)]
+
+@pytest.mark.parametrize("seed", range(5))
+def test_segment_stats_matches_nonzero(seed):
+    rng = np.random.default_rng(seed)
+    h, w = rng.integers(1, 40, size=2)
+    present = rng.choice(np.arange(1, 2**24), size=6, replace=False).astype(np.uint32)
+    ids = present[rng.integers(0, len(present), size=(h, w))]
+    ids[rng.random((h, w)) < 0.3] = 0
+    # ids absent from the mask (and duplicate keys)
+    keys = present[:4].tolist()+[int(present[0]), 2**24+5, 2**25]
+    for keys0 in [keys, None]:
+        ret_keys, area, bbox = segment_stats(ids, keys0)
+        expected_keys = sorted(set(keys)) if not keys0 is None else np.unique(ids).tolist()
+        assert ret_keys.tolist() == expected_keys
+        for k, area0, bbox0 in zip(ret_keys.tolist(), area.tolist(), bbox.tolist()):
+            assert (area0, bbox0) == stats_nonzero(ids, k), k
+
+def test_panoptic_audit(tmp_path):
+    ids, segments_info = random_frame(np.random.default_rng(5))
+    missing = [s["id"] for s in segments_info if not (ids == s["id"]).any()]
+    stale = None
+    for s in segments_info:
+        s["area"], s["bbox"] = stats_nonzero(ids, s["id"])
+        if s["area"] > 0 and stale is None:
+            stale = s
+    stale["area"] += 1
+    # a second entry with the same id describes the same pixels
+    json_path = write_dataset(str(tmp_path), [(ids, [s for s in segments_info if s["id"] != stale["id"]]+[stale])])
+    issues = panoptic_audit(json_path, tqdm_vers=tqdm_none)
+    assert sorted((i for _, i, _ in issues if not i is None)) == sorted(set(missing+[stale["id"]]))
+    # pixels of an id without segments_info entry
+    assert [issue for _, i, issue in issues if i is None] == ["mask ids without segments_info entry: [%d]"%(2**24-1)]
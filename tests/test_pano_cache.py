@@ -0,0 +1,18 @@
+# tests of the binary sidecar cache of panoptic jsons (pano_cache.py)
+import json
+import os
+
+from pano_cache import pano_cache_load, pano_cache_path
+
+PANO = {"images": [{"id": "f0", "file_name": "f0.jpg"}], "categories": [{"id": 7, "isthing": 0}],
+        "annotations": [{"image_id": "f0", "file_name": "f0.png",
+                         "segments_info": [{"id": 5, "category_id": 7, "iscrowd": 0, "area": 16, "bbox": [0, 0, 4, 4]}]}]}
+
+def test_cache_in_memory_if_not_writable(tmp_path):
+    json_path = str(tmp_path / "panoptic.json")
+    json.dump(PANO, open(json_path, "w"))
+    # blocks writing the cache file (a read-only directory does not stop root)
+    os.makedirs(pano_cache_path(json_path)+".tmp")
+    cache = pano_cache_load(json_path)
+    assert cache.annotation(0) == PANO["annotations"][0]
+    assert not os.path.exists(pano_cache_path(json_path))
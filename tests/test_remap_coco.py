@@ -0,0 +1,103 @@
+# tests of remap_coco.py on synthetic WD2 panoptic data (see benchmark.py)
+import json
+import os
+
+import numpy as np
+import pytest
+
+import remap_coco
+from benchmark import synth_panoptic
+
+META_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wd2_unified_label_policy.json")
+
+@pytest.fixture
+def pano_json(tmp_path):
+    return synth_panoptic(str(tmp_path / "pano"), num_frames=4, width=160, height=120, num_segments=20, meta_json=META_JSON)
+
+def remap(pano_json, output, *extra, tqdm_vers=remap_coco.tqdm_none):
+    return remap_coco.main(["--input", pano_json, "--output", output, "--meta_json", META_JSON, "--skip_masks"]+list(extra), tqdm_vers=tqdm_vers)
+
+def test_stream_json_identical(pano_json, tmp_path):
+    assert remap(pano_json, str(tmp_path / "full.json")) == 0
+    assert remap(pano_json, str(tmp_path / "stream.json"), "--stream_json") == 0
+    assert json.load(open(str(tmp_path / "full.json"))) == json.load(open(str(tmp_path / "stream.json")))
+
+def test_stream_json_aborted_leaves_no_tmp(pano_json, tmp_path):
+    def failing_tqdm(l, desc='', total=None):
+        for k, item in enumerate(l):
+            if k == 2:
+                raise KeyboardInterrupt()
+            yield item
+    output = str(tmp_path / "out.json")
+    with pytest.raises(KeyboardInterrupt):
+        remap(pano_json, output, "--stream_json", tqdm_vers=failing_tqdm)
+    assert not os.path.exists(output) and not os.path.exists(output+".tmp")
+
+def test_remap_annotation_zip_output(pano_json, tmp_path):
+    import zipfile
+    from mask_source import DeferredOutputs
+    src_to_trg, src_is_thing, trg_is_thing, _ = remap_coco.remapings_from_json(json.load(open(META_JSON)), "wd2eval")
+    annots = json.load(open(pano_json))["annotations"]
+    mask_dir, trg_dir = pano_json[:-5]+"/", str(tmp_path / "x.zip")+"/"
+    # zip archive outputs need a caller-managed DeferredOutputs; nothing may stay queued otherwise
+    with pytest.raises(ValueError):
+        remap_coco.remap_annotation(dict(annots[0]), src_to_trg, src_is_thing, trg_is_thing, src_dir=mask_dir, trg_dir=trg_dir)
+    with DeferredOutputs() as deferred_outputs:
+        for a in annots:
+            remap_coco.remap_annotation(a, src_to_trg, src_is_thing, trg_is_thing, src_dir=mask_dir, trg_dir=trg_dir, deferred_outputs=deferred_outputs)
+    assert sorted(zipfile.ZipFile(trg_dir[:-1]).namelist()) == sorted(a["file_name"] for a in annots)
+    assert remap_coco.take_deferred_writes() == []
+
+def test_stale_deferred_writes_are_discarded(pano_json, tmp_path):
+    import zipfile
+    from mask_source import defer_write
+    from pano2sem import panoptic2segm
+    defer_write(str(tmp_path / "leak.zip/stale.png"), b"stale")
+    assert panoptic2segm(pano_json, str(tmp_path / "sem.zip"), tqdm_vers=remap_coco.tqdm_none) == 4
+    assert not os.path.exists(str(tmp_path / "leak.zip"))
+    assert len(zipfile.ZipFile(str(tmp_path / "sem.zip")).namelist()) == 4
+
+# reference: area and tight bbox ([x, y, width, height]) of all pixels of old_ids from np.nonzero
+def stats_nonzero(ids, old_ids):
+    ys, xs = np.nonzero(np.isin(ids, old_ids))
+    if len(xs) == 0:
+        return 0, [0, 0, 0, 0]
+    return len(xs), [int(xs.min()), int(ys.min()), int(xs.max()-xs.min()+1), int(ys.max()-ys.min()+1)]
+
+@pytest.mark.parametrize("seed", range(5))
+def test_joined_segment_stats_matches_nonzero(seed):
+    rng = np.random.default_rng(seed)
+    h, w = rng.integers(8, 40, size=2)
+    present = rng.choice(np.arange(1, 2**24), size=8, replace=False).astype(np.uint32)
+    ids = np.zeros((h, w), dtype=np.uint32)
+    for i in present: # overlapping random rectangles
+        x0, x1 = sorted(rng.integers(0, w+1, size=2))
+        y0, y1 = sorted(rng.integers(0, h+1, size=2))
+        ids[y0:y1+1, x0:x1+1] = i
+    p = [i for i in present.tolist() if (ids == i).any()]
+    assert len(p) >= 4
+    # groups of old ids joined into their largest id; 2**24+1/2**24+2 are absent from the mask (one group completely)
+    groups = [p[0:3], p[3:4]+[2**24+1], [2**24+2, 2**24+3]]
+    joins = {old: max(g) for g in groups for old in g}
+    expected = sorted([max(g)]+list(stats_nonzero(ids, g)) for g in groups)
+    assert remap_coco.joined_segment_stats(ids, joins) == expected
+
+def test_joined_stats_replace_stale_metadata():
+    ids = np.zeros((20, 30), dtype=np.uint32)
+    ids[10:18, 20:25] = 11
+    ids[2:5, 3:9] = 12
+    ids[0:4, 25:30] = 13 # thing, not joined
+    # old area/bbox of the joined stuff segments are stale (e.g. edited masks), 14 is not in the mask
+    annot = {"file_name": "f.png", "segments_info": [
+        {"id": 11, "category_id": 1, "iscrowd": 0, "area": 999, "bbox": [0, 0, 1, 1]},
+        {"id": 12, "category_id": 2, "iscrowd": 0, "area": 5, "bbox": [7, 7, 3, 3]},
+        {"id": 14, "category_id": 3, "iscrowd": 0, "area": 77, "bbox": [1, 1, 28, 18]},
+        {"id": 13, "category_id": 4, "iscrowd": 0, "area": 20, "bbox": [25, 0, 5, 4]}]}
+    annot, joins = remap_coco.remap_annotation_segms(annot, {1: 10, 2: 10, 3: 10, 4: 20}, {1: 0, 2: 0, 3: 0, 4: 1}, {10: 0, 20: 1}, join_stuff=True)
+    assert joins == {11: 14, 12: 14, 14: 14}
+    joined = [s for s in annot["segments_info"] if s["id"] == 14][0]
+    assert joined["area"] == 999+5+77 # estimate from the old metadata
+    remap_coco.apply_joined_stats(annot, remap_coco.joined_segment_stats(ids, joins))
+    area, bbox = stats_nonzero(ids, [11, 12, 14])
+    assert (joined["area"], joined["bbox"]) == (area, bbox) == (3*6+8*5, [3, 2, 22, 16])
+    assert [s for s in annot["segments_info"] if s["id"] == 13][0] == {"id": 13, "category_id": 20, "iscrowd": 0, "area": 20, "bbox": [25, 0, 5, 4]}
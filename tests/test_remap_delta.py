@@ -0,0 +1,90 @@
+# regression tests of the numpy batch cross check in remap_delta.py against the per-segment loop
+import copy
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+
+_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "remap_delta", "remap_delta.py")
+_spec = importlib.util.spec_from_file_location("remap_delta_tool", _path)
+rd = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(rd)
+
+CATS = ["car", "truck", "van", "bus", "road"]
+
+def jitter_bbox(rng, bbox, as_float):
+    r = rng.random()
+    if r < 0.15:
+        # far away: no overlap
+        bbox = [bbox[0]+bbox[2]+50, bbox[1]+bbox[3]+50, bbox[2], bbox[3]]
+    else:
+        # small deviations around the cross check thresholds 0/1
+        bbox = [v+int(rng.integers(-2, 3)) if rng.random() < 0.4 else v for v in bbox]
+    if as_float:
+        bbox = [v+float(rng.choice([0.0, 0.25, 0.5, 0.75])) for v in bbox]
+    return bbox
+
+def random_polygon(rng):
+    x0, y0 = rng.integers(0, 200, size=2)
+    n = int(rng.integers(1, 7))
+    verts = np.stack([x0+rng.random(n)*40, y0+rng.random(n)*30], axis=1)
+    if rng.random() < 0.5:
+        verts = np.round(verts, 0)
+    return verts.tolist()
+
+def random_frame(rng, polygons, num_segs=12, num_deltas=16):
+    segs = []
+    for k in range(num_segs):
+        if polygons:
+            s = {"label": CATS[rng.integers(0, len(CATS))], "polygon": random_polygon(rng)}
+            if rng.random() < 0.2:
+                s["bbox"] = rd.poly2bbox(s["polygon"])
+        else:
+            s = {"id": int(1000+7*k), "category_id": CATS[rng.integers(0, len(CATS))], "iscrowd": 0}
+            if rng.random() < 0.85: # segments without bbox are never cross checked
+                bbox = [int(v) for v in rng.integers(0, 200, size=2)]+[int(v) for v in rng.integers(1, 60, size=2)]
+                s["bbox"] = [v+0.5 for v in bbox] if rng.random() < 0.3 else bbox
+        segs.append(s)
+    deltas = []
+    for _ in range(num_deltas):
+        # repeated ids: later deltas of a segment see the category changed by earlier ones
+        idx = int(rng.integers(0, num_segs))
+        src = segs[idx]
+        src_bbox = src.get("bbox") or (rd.poly2bbox(src["polygon"]) if "polygon" in src else [0, 0, 10, 10])
+        cat = src["label"] if polygons else src["category_id"]
+        d = {"id": idx if polygons else src["id"], "old": cat if rng.random() < 0.7 else CATS[rng.integers(0, len(CATS))],
+             "new": CATS[rng.integers(0, len(CATS))], "bbox": jitter_bbox(rng, list(src_bbox), rng.random() < 0.3)}
+        if rng.random() < 0.3:
+            d["bbox_vis"] = jitter_bbox(rng, list(src_bbox), rng.random() < 0.3)
+        if rng.random() < 0.2:
+            d["is_crowd"] = 1
+        deltas.append(d)
+    return segs, deltas
+
+@pytest.mark.parametrize("cross_check_delta", [-1, 0, 1])
+@pytest.mark.parametrize("polygons", [False, True])
+def test_batch_matches_loop(monkeypatch, polygons, cross_check_delta):
+    rng = np.random.default_rng(17+int(polygons))
+    num_errors = 0
+    for _ in range(300):
+        segs, deltas = random_frame(rng, polygons, num_deltas=int(rng.integers(rd.batch_min_segms, 24)))
+        segs_batch, segs_loop = copy.deepcopy(segs), copy.deepcopy(segs)
+        ret_batch = rd.remap_inplace_onefrm(segs_batch, copy.deepcopy(deltas), cross_check_delta=cross_check_delta)
+        with monkeypatch.context() as m:
+            m.setattr(rd, "batch_min_segms", 10**9)
+            ret_loop = rd.remap_inplace_onefrm(segs_loop, copy.deepcopy(deltas), cross_check_delta=cross_check_delta)
+        assert ret_batch == ret_loop
+        assert segs_batch == segs_loop
+        num_errors += len(ret_loop[0])
+    # the random frames produce both outcomes
+    assert (num_errors > 0) == (cross_check_delta >= 0)
+
+def test_batch_used_for_many_deltas(monkeypatch):
+    calls = []
+    batch0 = rd.remap_inplace_onefrm_batch
+    monkeypatch.setattr(rd, "remap_inplace_onefrm_batch", lambda *args, **kwargs: calls.append(1) or batch0(*args, **kwargs))
+    segs, deltas = random_frame(np.random.default_rng(0), False, num_deltas=rd.batch_min_segms)
+    rd.remap_inplace_onefrm(segs, deltas)
+    rd.remap_inplace_onefrm(segs, deltas[:rd.batch_min_segms-1])
+    assert len(calls) == 1